@@ -0,0 +1,239 @@
+"""Throughput benchmark for PDFOutlineExtractor on synthetic PDFs.
+
+    python benchmark.py                      # run all scenarios, check thresholds
+    python benchmark.py --scenario medium --rounds 10
+    python benchmark.py --update-thresholds  # record current numbers
+
+Each scenario generates a PDF with a known page count, heading density, font
+mix and script, then times the extraction phases separately (open, font
+ranks, page walk, normalization, JSON write). A scenario regresses when its
+median pages/s falls below the value stored in bench_thresholds.json.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Sequence
+
+import fitz
+
+from extract_pdf import PDFOutlineExtractor, logger
+
+THRESHOLDS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_thresholds.json")
+# Stored thresholds are this fraction of the measured median, to absorb noise.
+THRESHOLD_MARGIN = 0.6
+
+WORDS = {
+    "latin": "the of and outline section report data model review summary analysis method result plan".split(),
+    "cjk": list("数据分析方法结果计划报告模型概述章节目录系统设计测试"),
+}
+FONTS = {
+    "latin": {"body": "helv", "bold": "hebo", "italic": "heit"},
+    "cjk": {"body": "china-s", "bold": "china-s", "italic": "china-s"},
+}
+HEADING_SIZES = (24, 18, 14)
+BODY_SIZE = 10
+
+
+@dataclass
+class Scenario:
+    name: str
+    pages: int
+    headings_per_page: int
+    body_lines_per_page: int
+    languages: Sequence[str] = ("latin",)
+    bold_ratio: float = 0.2
+    # fraction of pages that carry any headings at all
+    heading_page_ratio: float = 1.0
+    # run the extractor with adaptive page sampling and no page cap
+    adaptive: bool = False
+
+
+SCENARIOS = {
+    s.name: s
+    for s in (
+        Scenario("small", pages=5, headings_per_page=3, body_lines_per_page=30),
+        Scenario("medium", pages=50, headings_per_page=4, body_lines_per_page=45),
+        Scenario("dense", pages=50, headings_per_page=15, body_lines_per_page=20, bold_ratio=0.5),
+        Scenario("multilingual", pages=30, headings_per_page=4, body_lines_per_page=40, languages=("latin", "cjk")),
+        Scenario(
+            "long", pages=1000, headings_per_page=3, body_lines_per_page=40,
+            bold_ratio=1.0, heading_page_ratio=0.1, adaptive=True,
+        ),
+    )
+}
+
+
+def _phrase(rng: random.Random, language: str, n_words: int) -> str:
+    words = [rng.choice(WORDS[language]) for _ in range(n_words)]
+    return ("" if language == "cjk" else " ").join(words)
+
+
+def generate_pdf(path: str, scenario: Scenario, seed: int = 0) -> None:
+    """Write a synthetic PDF whose layout follows ``scenario``."""
+    rng = random.Random(seed)
+    doc = fitz.open()
+    width, height = fitz.paper_size("a4")
+    for pno in range(scenario.pages):
+        page = doc.new_page(width=width, height=height)
+        has_headings = pno == 0 or rng.random() < scenario.heading_page_ratio
+        n_headings = scenario.headings_per_page if has_headings else 0
+        lines = n_headings + scenario.body_lines_per_page
+        heading_slots = set(rng.sample(range(lines), n_headings))
+        y = 50.0
+        for i in range(lines):
+            language = rng.choice(scenario.languages)
+            fonts = FONTS[language]
+            if i in heading_slots:
+                size = rng.choice(HEADING_SIZES)
+                font = fonts["bold"] if rng.random() < scenario.bold_ratio else fonts["body"]
+                text = f"{pno + 1}.{i} " + _phrase(rng, language, rng.randint(2, 6))
+            else:
+                size = BODY_SIZE
+                font = fonts["italic"] if rng.random() < 0.05 else fonts["body"]
+                text = _phrase(rng, language, rng.randint(8, 14)) + "."
+            if y + size * 1.6 > height - 40:
+                break
+            y += size * 1.6
+            page.insert_text((50, y), text, fontsize=size, fontname=font)
+    doc.set_metadata({"title": f"Synthetic {scenario.name}"})
+    doc.save(path)
+    doc.close()
+
+
+class TimedExtractor(PDFOutlineExtractor):
+    """Extractor that records normalization time separately from the page walk."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.normalize_seconds = 0.0
+
+    def _normalize_many(self, texts):
+        start = time.perf_counter()
+        try:
+            return super()._normalize_many(texts)
+        finally:
+            self.normalize_seconds += time.perf_counter() - start
+
+
+def run_once(pdf_path: str, out_path: str, max_pages: int, adaptive: bool = False) -> Dict[str, float]:
+    phases: Dict[str, float] = {}
+    ex = TimedExtractor(pdf_path, max_pages=max_pages, adaptive=adaptive)
+
+    start = time.perf_counter()
+    doc = ex._open_document()
+    phases["open"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    ex._collect_font_ranks(doc)
+    phases["font_ranks"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    meta_title = (doc.metadata.get("title") or "").strip() if doc.metadata else ""
+    ex._walk_pages(doc)
+    result = ex._result(meta_title)
+    phases["normalization"] = ex.normalize_seconds
+    phases["page_walk"] = time.perf_counter() - start - ex.normalize_seconds
+    pages = min(doc.page_count, max_pages)
+    doc.close()
+
+    start = time.perf_counter()
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+    phases["json_write"] = time.perf_counter() - start
+
+    phases["total"] = sum(phases.values())
+    phases["pages"] = pages
+    return phases
+
+
+def bench_scenario(scenario: Scenario, rounds: int, workdir: str) -> Dict[str, object]:
+    pdf_path = os.path.join(workdir, f"{scenario.name}.pdf")
+    out_path = os.path.join(workdir, f"{scenario.name}.json")
+    generate_pdf(pdf_path, scenario)
+    run_once(pdf_path, out_path, scenario.pages, scenario.adaptive)  # warm-up
+    runs = [run_once(pdf_path, out_path, scenario.pages, scenario.adaptive) for _ in range(rounds)]
+
+    phases = {}
+    for name in ("open", "font_ranks", "page_walk", "normalization", "json_write", "total"):
+        values = [r[name] for r in runs]
+        phases[name] = {
+            "min": min(values),
+            "median": statistics.median(values),
+            "mean": statistics.fmean(values),
+            "stddev": statistics.stdev(values) if len(values) > 1 else 0.0,
+        }
+    pages = runs[0]["pages"]
+    return {
+        "pages": pages,
+        "phases": phases,
+        "pages_per_sec": pages / phases["total"]["median"],
+    }
+
+
+def print_report(name: str, report: Dict[str, object]) -> None:
+    print(f"\n{name}: {report['pages']} pages, {report['pages_per_sec']:.1f} pages/s (median)")
+    print(f"  {'phase':<14s} {'min ms':>9s} {'median ms':>10s} {'mean ms':>9s} {'stddev':>8s}")
+    for phase, stats in report["phases"].items():
+        print(
+            f"  {phase:<14s} {stats['min'] * 1e3:9.2f} {stats['median'] * 1e3:10.2f}"
+            f" {stats['mean'] * 1e3:9.2f} {stats['stddev'] * 1e3:8.2f}"
+        )
+
+
+def load_thresholds() -> Dict[str, float]:
+    if not os.path.exists(THRESHOLDS_PATH):
+        return {}
+    with open(THRESHOLDS_PATH, "r", encoding="utf-8") as f:
+        return json.load(f)["min_pages_per_sec"]
+
+
+def save_thresholds(reports: Dict[str, Dict[str, object]]) -> None:
+    thresholds = load_thresholds()
+    for name, report in reports.items():
+        thresholds[name] = round(report["pages_per_sec"] * THRESHOLD_MARGIN, 1)
+    with open(THRESHOLDS_PATH, "w", encoding="utf-8") as f:
+        json.dump({"min_pages_per_sec": thresholds}, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), help="scenario(s) to run")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--json", dest="json_out", default=None, help="also write the report to this file")
+    parser.add_argument("--update-thresholds", action="store_true")
+    args = parser.parse_args(argv)
+
+    logger.setLevel("WARNING")
+    names = args.scenario or list(SCENARIOS)
+    with tempfile.TemporaryDirectory() as workdir:
+        reports = {name: bench_scenario(SCENARIOS[name], args.rounds, workdir) for name in names}
+    for name, report in reports.items():
+        print_report(name, report)
+
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(reports, f, indent=2)
+    if args.update_thresholds:
+        save_thresholds(reports)
+        print(f"\nThresholds written to {THRESHOLDS_PATH}")
+        return 0
+
+    failed = 0
+    thresholds = load_thresholds()
+    for name, report in reports.items():
+        floor = thresholds.get(name)
+        if floor is not None and report["pages_per_sec"] < floor:
+            print(f"REGRESSION {name}: {report['pages_per_sec']:.1f} pages/s < {floor} pages/s")
+            failed += 1
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
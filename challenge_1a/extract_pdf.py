@@ -5,8 +5,31 @@ import sys
 import logging
 import unicodedata
 import re
-from dataclasses import dataclass
-from typing import Dict, List, Optional, Any, Sequence
+import gzip
+import hashlib
+import time
+import signal
+import zlib
+import argparse
+import threading
+import gc
+from collections import deque
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Any, Sequence, Iterator, Tuple
+
+import numpy as np
+
+from spantable import FontTable, SpanTable
+
+try:
+    from re import _constants as sre_constants, _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_constants
+    import sre_parse
 
 # Logging setup
 logging.basicConfig(
@@ -25,15 +48,23 @@ except Exception:
 
 # Regex patterns
 BULLET_PREFIX_RE = re.compile(r"^[\u2022\-\*\d]+\s*")
-URL_RE = re.compile(r"^https?://", re.IGNORECASE)
-CODE_FENCE_RE = re.compile(r"^`{3}")
+# URLs and code fences, matched at the start of a block in one pass.
+URL_OR_CODE_RE = re.compile(r"(?i:https?://)|`{3}")
 
 # Font detection hints
 WEIGHT_HINTS = ("bold", "black", "heavy", "semibold", "demi")
 ITALIC_HINTS = ("italic", "oblique")
 
+# Page text flags: the default "dict" flags minus embedded images, whose
+# binary payloads we never look at.
+TEXT_FLAGS = fitz.TEXTFLAGS_DICT & ~fitz.TEXT_PRESERVE_IMAGES
+
 MIN_ALNUM_CHARS = 3  # drop junk like '{', '}' etc.
 MAX_HEADING_WORDS_EXTENDED = 25  # allow longer headings
+# A bookmark tree is trusted when at least this share of its entries is found
+# on the page it points to.
+TOC_MIN_VALID_RATIO = 0.8
+TOC_MODES = ("off", "prefer", "merge")
 
 # Optional explicit pattern -> level overrides
 HEADING_LEVEL_OVERRIDES = [
@@ -42,6 +73,9 @@ HEADING_LEVEL_OVERRIDES = [
     (re.compile(r"^appendix$", re.I), "H1"),
 ]
 
+# Level codes used by the vectorized size classification; 0 means none.
+LEVEL_NAMES = (None, "H1", "H2", "H3")
+
 
 @dataclass
 class Heading:
@@ -50,6 +84,102 @@ class Heading:
     page: int
 
 
+@dataclass
+class ExtractionMetrics:
+    """Opt-in per-document counters and timings (PDFOutlineExtractor(instrument=True))."""
+
+    document: str = ""
+    bytes_read: int = 0
+    pages: int = 0
+    blocks: int = 0
+    spans: int = 0
+    headings_kept: int = 0
+    # pages the adaptive pre-scan ruled out without decoding them
+    pages_skipped: int = 0
+    # reason -> count, for blocks that did not make it into the outline
+    rejected: Dict[str, int] = field(default_factory=dict)
+    # open, font_ranks, page_walk, total, plus decode/normalize/overrides/title inside them
+    phase_seconds: Dict[str, float] = field(default_factory=dict)
+    page_seconds: List[float] = field(default_factory=list)
+
+    def add_time(self, phase: str, seconds: float) -> None:
+        self.phase_seconds[phase] = self.phase_seconds.get(phase, 0.0) + seconds
+
+    def reject(self, reason: str) -> None:
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(self.__dict__)
+
+
+class MetricsAggregate:
+    """Sums ExtractionMetrics dicts across documents; exports JSON or Prometheus text."""
+
+    DOC_SECONDS_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+    COUNTERS = ("bytes_read", "pages", "pages_skipped", "blocks", "spans", "headings_kept")
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.documents = 0
+        self.failures = 0
+        self.counters: Dict[str, int] = {name: 0 for name in self.COUNTERS}
+        self.rejected: Dict[str, int] = {}
+        self.phase_seconds: Dict[str, float] = {}
+        self.doc_seconds_buckets = [0] * len(self.DOC_SECONDS_BUCKETS)
+        self.doc_seconds_sum = 0.0
+
+    def add(self, metrics: Optional[Dict[str, Any]], failed: bool = False) -> None:
+        with self._lock:
+            if failed:
+                self.failures += 1
+            if not metrics:
+                return
+            self.documents += 1
+            for name in self.COUNTERS:
+                self.counters[name] += metrics.get(name, 0)
+            for reason, n in metrics.get("rejected", {}).items():
+                self.rejected[reason] = self.rejected.get(reason, 0) + n
+            for phase, seconds in metrics.get("phase_seconds", {}).items():
+                self.phase_seconds[phase] = self.phase_seconds.get(phase, 0.0) + seconds
+            total = metrics.get("phase_seconds", {}).get("total", 0.0)
+            self.doc_seconds_sum += total
+            for i, bound in enumerate(self.DOC_SECONDS_BUCKETS):
+                if total <= bound:
+                    self.doc_seconds_buckets[i] += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "documents": self.documents,
+                "failures": self.failures,
+                **self.counters,
+                "rejected": dict(self.rejected),
+                "phase_seconds": dict(self.phase_seconds),
+            }
+
+    def to_prometheus(self, prefix: str = "pdf_outline") -> str:
+        with self._lock:
+            out = [
+                f"# TYPE {prefix}_documents_total counter",
+                f"{prefix}_documents_total {self.documents}",
+                f"# TYPE {prefix}_failures_total counter",
+                f"{prefix}_failures_total {self.failures}",
+            ]
+            for name, value in self.counters.items():
+                out += [f"# TYPE {prefix}_{name}_total counter", f"{prefix}_{name}_total {value}"]
+            out.append(f"# TYPE {prefix}_headings_rejected_total counter")
+            out += [f'{prefix}_headings_rejected_total{{reason="{r}"}} {n}' for r, n in sorted(self.rejected.items())]
+            out.append(f"# TYPE {prefix}_phase_seconds_total counter")
+            out += [f'{prefix}_phase_seconds_total{{phase="{p}"}} {s:.6f}' for p, s in sorted(self.phase_seconds.items())]
+            out.append(f"# TYPE {prefix}_document_seconds histogram")
+            for bound, n in zip(self.DOC_SECONDS_BUCKETS, self.doc_seconds_buckets):
+                out.append(f'{prefix}_document_seconds_bucket{{le="{bound}"}} {n}')
+            out.append(f'{prefix}_document_seconds_bucket{{le="+Inf"}} {self.documents}')
+            out.append(f"{prefix}_document_seconds_sum {self.doc_seconds_sum:.6f}")
+            out.append(f"{prefix}_document_seconds_count {self.documents}")
+            return "\n".join(out) + "\n"
+
+
 def is_bold_font(font_name: str) -> bool:
     fn = font_name.lower()
     return any(w in fn for w in WEIGHT_HINTS)
@@ -60,20 +190,200 @@ def is_italic_font(font_name: str) -> bool:
     return any(w in fn for w in ITALIC_HINTS)
 
 
+SUBSET_PREFIX_RE = re.compile(r"^[A-Z]{6}\+")
+
+
+def base_font_name(font_name: str) -> str:
+    """Font name as reported in text spans ("ABCDEF+Arial,Bold" -> "Arial,Bold")."""
+    return SUBSET_PREFIX_RE.sub("", font_name)
+
+
 def normalize_basic(text: str) -> str:
     text = unicodedata.normalize("NFKC", text)
     return " ".join(text.split()).strip()
 
 
+def _match_key(text: str) -> str:
+    return normalize_basic(text).casefold()
+
+
+# Process-wide SentencePiece registry: each model file is loaded once and shared
+# by every extractor (and, via fork, every batch worker). Failed loads are
+# cached as None so a bad path does not retry per block.
+_SPM_MODELS: Dict[str, Any] = {}
+_SPM_LOCK = threading.Lock()
+
+
+def get_sentencepiece(sp_model_path: Optional[str]) -> Optional[Any]:
+    if not (sp_model_path and _HAS_SPM):
+        return None
+    key = os.path.abspath(sp_model_path)
+    if key in _SPM_MODELS:
+        return _SPM_MODELS[key]
+    with _SPM_LOCK:
+        if key not in _SPM_MODELS:
+            sp = None
+            if os.path.exists(key):
+                try:
+                    sp = spm.SentencePieceProcessor(model_file=key)
+                except Exception as e:
+                    logger.error(f"Could not load SentencePiece model {key}: {e}")
+            _SPM_MODELS[key] = sp
+        return _SPM_MODELS[key]
+
+
+def normalize_sentencepiece_many(texts: Sequence[str], sp_model_path: Optional[str]) -> List[str]:
+    # Encoding is a const operation on the loaded model, so the shared
+    # processor can be used from several threads without locking.
+    sp = get_sentencepiece(sp_model_path)
+    if sp is None:
+        return [normalize_basic(t) for t in texts]
+    try:
+        pieces = sp.encode(list(texts), out_type=str)
+    except Exception:
+        return [normalize_basic(t) for t in texts]
+    return [" ".join(toks).strip() or normalize_basic(t) for t, toks in zip(texts, pieces)]
+
+
 def normalize_sentencepiece(text: str, sp_model_path: Optional[str]) -> str:
-    if not (sp_model_path and _HAS_SPM and os.path.exists(sp_model_path)):
-        return normalize_basic(text)
+    return normalize_sentencepiece_many([text], sp_model_path)[0]
+
+
+class MemoryBudgetExceeded(RuntimeError):
+    pass
+
+
+def current_rss_bytes() -> int:
+    """Resident set size of this process, or 0 where it cannot be read cheaply."""
     try:
-        sp = spm.SentencePieceProcessor(model_file=sp_model_path)
-        toks = sp.encode(text, out_type=str)
-        return " ".join(toks).strip() or normalize_basic(text)
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return 0
+
+
+class HeadingRules:
+    r"""Heading text rules: pattern -> level overrides plus the reject filters.
+
+    Overrides are indexed by a literal each pattern requires (e.g. "appendix"
+    in ``^appendix$``). A block is scanned once for those literals and
+    only the patterns whose literal occurs are run, in list order, so the
+    first matching rule still wins. Patterns without a usable literal are
+    always run.
+    """
+
+    # Shorter literals filter too little to be worth a lookup.
+    MIN_LITERAL_CHARS = 3
+
+    def __init__(self, overrides: Sequence[Tuple[Any, str]] = ()):
+        self.overrides = [(re.compile(p) if isinstance(p, str) else p, level) for p, level in overrides]
+        # literal -> indices of the patterns that need it; case-insensitive
+        # literals are stored lowercased and checked against lowered text.
+        self._by_literal: Dict[str, List[int]] = {}
+        self._by_literal_ci: Dict[str, List[int]] = {}
+        self._unindexed: List[int] = []
+        for i, (rx, _) in enumerate(self.overrides):
+            literal = _required_literal(rx)
+            if literal is None:
+                self._unindexed.append(i)
+            elif rx.flags & re.IGNORECASE:
+                self._by_literal_ci.setdefault(literal.lower(), []).append(i)
+            else:
+                self._by_literal.setdefault(literal, []).append(i)
+
+    @classmethod
+    def from_json(cls, path: str, include_defaults: bool = True) -> "HeadingRules":
+        """Load ``[{"pattern": ..., "level": "H1", "ignore_case": true}, ...]`` from ``path``."""
+        with open(path, "r", encoding="utf-8") as f:
+            rules = json.load(f)
+        overrides = list(HEADING_LEVEL_OVERRIDES) if include_defaults else []
+        for rule in rules:
+            flags = re.IGNORECASE if rule.get("ignore_case", True) else 0
+            overrides.append((re.compile(rule["pattern"], flags), rule["level"]))
+        return cls(overrides)
+
+    def _candidates(self, text: str) -> List[int]:
+        found = list(self._unindexed)
+        for literal, idx in self._by_literal.items():
+            if literal in text:
+                found.extend(idx)
+        if self._by_literal_ci:
+            # casefold covers the non-ASCII letters re.IGNORECASE equates with
+            # ASCII ones ("\u017f" ~ "s", "\u212a" ~ "k") except two forms of i:
+            # dotless "\u0131" and "\u0130", which casefolds to "i\u0307".
+            lowered = (
+                text.lower() if text.isascii()
+                else text.casefold().replace("\u0131", "i").replace("i\u0307", "i")
+            )
+            for literal, idx in self._by_literal_ci.items():
+                if literal in lowered:
+                    found.extend(idx)
+        found.sort()
+        return found
+
+    def level_for(self, text: str) -> Optional[str]:
+        """Level forced by the first matching override, or None."""
+        overrides = self.overrides
+        for i in self._candidates(text):
+            rx, level = overrides[i]
+            if rx.search(text):
+                return level
+        return None
+
+    @staticmethod
+    def strip_bullet(text: str) -> Tuple[bool, str]:
+        """(has bullet prefix, text without it)."""
+        m = BULLET_PREFIX_RE.match(text)
+        return (True, text[m.end():].strip()) if m else (False, text.strip())
+
+    def reject_reason(self, text: str, num_lines: int = 1, max_words: int = 12, clean: Optional[str] = None) -> Optional[str]:
+        if num_lines > 3:
+            return "too_many_lines"
+
+        if URL_OR_CODE_RE.match(text):
+            return "url_or_code"
+
+        if clean is None:
+            clean = self.strip_bullet(text)[1]
+
+        if _alnum_count(clean) < MIN_ALNUM_CHARS:
+            return "too_few_alnum"
+
+        words = clean.split()
+        if len(words) > max_words and len(words) > MAX_HEADING_WORDS_EXTENDED:
+            return "too_many_words"
+
+        if clean.endswith((".", "?", "!")) and len(words) > 3:
+            return "sentence"
+
+        return None
+
+    def fingerprint_data(self) -> List[Tuple[str, int, str]]:
+        return [(rx.pattern, rx.flags, level) for rx, level in self.overrides]
+
+
+def _required_literal(rx: re.Pattern) -> Optional[str]:
+    """Longest ASCII literal run every match of ``rx`` must contain, if any."""
+    try:
+        tree = sre_parse.parse(rx.pattern, rx.flags)
     except Exception:
-        return normalize_basic(text)
+        return None
+    best, run = "", []
+    for op, arg in list(tree) + [(None, None)]:
+        if op == sre_constants.LITERAL and arg < 128:
+            run.append(chr(arg))
+            continue
+        if len(run) > len(best):
+            best = "".join(run)
+        run = []
+    return best if len(best) >= HeadingRules.MIN_LITERAL_CHARS else None
+
+
+DEFAULT_RULES = HeadingRules(HEADING_LEVEL_OVERRIDES)
+
+
+# Per-block verdict placeholder: the reject reason has not been computed yet.
+_UNCHECKED = object()
 
 
 def _alnum_count(text: str) -> int:
@@ -84,42 +394,172 @@ class PDFOutlineExtractor:
     def __init__(
         self,
         pdf_path: str,
-        max_pages: int = 50,
+        max_pages: Optional[int] = 50,
         scan_pages_for_stats: int = 5,
         title_scan_pages: int = 3,
         font_size_tolerance: float = 0.75,
         sp_model_path: Optional[str] = None,
         max_heading_words: int = 12,
+        page_cache_spans: int = 200_000,
+        pdf_bytes: Optional[bytes] = None,
+        instrument: bool = False,
+        max_rss_mb: Optional[int] = None,
+        adaptive: bool = False,
+        sample_every: int = 10,
+        toc_mode: str = "off",
+        rules: Optional[HeadingRules] = None,
     ):
+        if toc_mode not in TOC_MODES:
+            raise ValueError(f"toc_mode must be one of {TOC_MODES}, not {toc_mode!r}")
         self.pdf_path = pdf_path
+        # In-memory PDF (e.g. an upload); pdf_path is then only a label.
+        self.pdf_bytes = pdf_bytes
         self.max_pages = max_pages
         self.scan_pages_for_stats = scan_pages_for_stats
         self.title_scan_pages = title_scan_pages
         self.font_size_tolerance = font_size_tolerance
         self.sp_model_path = sp_model_path
         self.max_heading_words = max_heading_words
+        self.page_cache_spans = page_cache_spans
+        self.max_rss_mb = max_rss_mb
+        # Adaptive mode decodes only pages whose fonts suggest headings (see
+        # _page_may_have_headings); max_pages=None lifts the page cap.
+        self.adaptive = adaptive
+        self.sample_every = sample_every
+        # "prefer": use the bookmark tree when it checks out against the page
+        # text, skipping the font heuristic; "merge": heuristic outline plus
+        # validated bookmarks; "off": heuristic only.
+        self.toc_mode = toc_mode
+        self.rules = rules if rules is not None else DEFAULT_RULES
 
         self.font_ranks: List[float] = []
+        # Pages decoded during the stats pass, consumed by the classification pass.
+        self._page_cache: Dict[int, SpanTable] = {}
+        self._fonts = FontTable()
         self.outline: List[Heading] = []
         self.title: Optional[str] = None
+        self._first_heading: Optional[str] = None
+        self._seen_fonts: set = set()
+        self._heading_fonts: set = set()
+        self._bookmark_pages: set = set()
+        self.metrics: Optional[ExtractionMetrics] = ExtractionMetrics(document=pdf_path) if instrument else None
 
     def _normalize_text(self, text: str) -> str:
         return normalize_sentencepiece(text, self.sp_model_path)
 
+    def _normalize_many(self, texts: Sequence[str]) -> List[str]:
+        return normalize_sentencepiece_many(texts, self.sp_model_path)
+
+    def config_fingerprint(self) -> str:
+        """Hash of every setting that can change the extracted outline."""
+        config = {
+            "max_pages": self.max_pages,
+            "scan_pages_for_stats": self.scan_pages_for_stats,
+            "title_scan_pages": self.title_scan_pages,
+            "adaptive": self.adaptive,
+            "sample_every": self.sample_every if self.adaptive else None,
+            "toc_mode": self.toc_mode,
+            "toc_min_valid_ratio": TOC_MIN_VALID_RATIO if self.toc_mode != "off" else None,
+            "font_size_tolerance": self.font_size_tolerance,
+            "max_heading_words": self.max_heading_words,
+            "sp_model_path": self.sp_model_path,
+            "overrides": self.rules.fingerprint_data(),
+            "min_alnum_chars": MIN_ALNUM_CHARS,
+            "max_heading_words_extended": MAX_HEADING_WORDS_EXTENDED,
+        }
+        return hashlib.sha256(json.dumps(config, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+    def _check_memory(self) -> None:
+        if not self.max_rss_mb:
+            return
+        limit = self.max_rss_mb * 1024 * 1024
+        if current_rss_bytes() <= limit:
+            return
+        # Give back what we can (page cache, MuPDF's object store) before failing.
+        self._page_cache.clear()
+        fitz.TOOLS.store_shrink(100)
+        gc.collect()
+        rss = current_rss_bytes()
+        if rss > limit:
+            raise MemoryBudgetExceeded(
+                f"RSS {rss >> 20} MB exceeds the {self.max_rss_mb} MB ceiling on {self.pdf_path}"
+            )
+
+    def _decode_page(self, doc: fitz.Document, pno: int) -> SpanTable:
+        self._check_memory()
+        start = time.perf_counter() if self.metrics else 0.0
+        # Only the span table outlives this call; the page object and its
+        # decoded dict are released as soon as it returns.
+        table = SpanTable.from_page(doc.load_page(pno).get_text("dict", flags=TEXT_FLAGS), pno, self._fonts)
+        if self.metrics:
+            self.metrics.add_time("decode", time.perf_counter() - start)
+        return table
+
+    def _page_blocks(self, doc: fitz.Document, pno: int) -> SpanTable:
+        # Each page is decoded once: stats pages come out of the cache (and are
+        # released as they are consumed), everything else is decoded on demand.
+        cached = self._page_cache.pop(pno, None)
+        return cached if cached is not None else self._decode_page(doc, pno)
+
+    def _page_limit(self, doc: fitz.Document) -> int:
+        return doc.page_count if self.max_pages is None else min(doc.page_count, self.max_pages)
+
+    def _page_may_have_headings(self, doc: fitz.Document, pno: int) -> bool:
+        """Adaptive pre-scan: decide from the page's font resources alone.
+
+        A page is decoded when it is in the stats/title range, is a bookmark
+        target, falls on the sampling stride, or uses a font that is bold, has
+        not been seen yet, or has already carried heading-sized text. Pages
+        set entirely in known body fonts are skipped.
+        """
+        if (
+            pno in self._page_cache
+            or pno < max(self.title_scan_pages, self.scan_pages_for_stats)
+            or pno in self._bookmark_pages
+            or (self.sample_every and pno % self.sample_every == 0)
+        ):
+            return True
+        try:
+            fonts = {base_font_name(f[3]) for f in doc.get_page_fonts(pno)}
+        except Exception:
+            return True
+        if not fonts:
+            # Fonts may sit in resources we do not inspect; do not guess.
+            return True
+        return any(
+            f in self._heading_fonts or f not in self._seen_fonts or is_bold_font(f)
+            for f in fonts
+        )
+
+    def _learn_fonts(self, table: SpanTable) -> None:
+        names = self._fonts.names
+        self._seen_fonts.update(names[f] for f in np.unique(table.font).tolist())
+        heading = table.nonblank & (self._size_levels(table.size) > 0)
+        self._heading_fonts.update(names[f] for f in np.unique(table.font[heading]).tolist())
+
     def _collect_font_ranks(self, doc: fitz.Document) -> None:
-        sizes = []
-        scan = min(doc.page_count, self.scan_pages_for_stats, self.max_pages)
+        sizes: List[float] = []
+        cached_spans = 0
+        self._page_cache.clear()
+        if self.adaptive:
+            try:
+                self._bookmark_pages = {page - 1 for _, _, page in doc.get_toc(simple=True) if page > 0}
+            except Exception:
+                self._bookmark_pages = set()
+        scan = min(self._page_limit(doc), self.scan_pages_for_stats)
         for i in range(scan):
             try:
-                blocks = doc[i].get_text("dict")["blocks"]
+                table = self._decode_page(doc, i)
+            except MemoryBudgetExceeded:
+                raise  # font ranks from fewer pages would silently change the outline
             except Exception:
                 continue
-            for b in blocks:
-                for l in b.get("lines", []):
-                    for s in l.get("spans", []):
-                        txt = s["text"].strip()
-                        if txt and not is_italic_font(s["font"]):
-                            sizes.append(s["size"])
+            italic = self._fonts.mask(is_italic_font)
+            sizes.extend(table.size[table.nonblank & ~italic[table.font]].tolist())
+            # Memory budget: pages beyond it are decoded again in phase two.
+            if cached_spans + len(table) <= self.page_cache_spans:
+                self._page_cache[i] = table
+                cached_spans += len(table)
         uniq = sorted(set(sizes), reverse=True)
         collapsed: List[float] = []
         for sz in uniq:
@@ -134,153 +574,870 @@ class PDFOutlineExtractor:
                 return ("H1", "H2", "H3")[idx]
         return None
 
-    def _should_keep_heading_text(self, text: str, num_lines: int = 1) -> bool:
-        if num_lines > 3:
-            return False
+    def _size_levels(self, sizes: np.ndarray) -> np.ndarray:
+        """Vectorized _size_to_level: level code (0 = none, 1-3 = H1-H3) per size."""
+        if not self.font_ranks:
+            return np.zeros(len(sizes), dtype=np.int8)
+        near = np.abs(sizes[:, None] - np.asarray(self.font_ranks)[None, :]) <= self.font_size_tolerance
+        return np.where(near.any(axis=1), near.argmax(axis=1) + 1, 0).astype(np.int8)
 
-        if URL_RE.match(text) or CODE_FENCE_RE.match(text):
-            return False
-
-        clean = BULLET_PREFIX_RE.sub("", text).strip()
+    def _block_levels(self, table: SpanTable, sizes: np.ndarray) -> np.ndarray:
+        """Font-based level code per block: size rank, else the bold-font fallback."""
+        levels = self._size_levels(sizes)
+        first_font = table.block_first(table.font)
+        bold = self._fonts.mask(is_bold_font)[first_font] & ~self._fonts.mask(is_italic_font)[first_font]
+        fallback = (levels == 0) & bold
+        if self.font_ranks:
+            levels[fallback] = np.where(sizes[fallback] > self.font_ranks[-1], 2, 3)
+        else:
+            levels[fallback] = 3
+        return levels
 
-        if _alnum_count(clean) < MIN_ALNUM_CHARS:
-            return False
-
-        words = clean.split()
-        if len(words) > self.max_heading_words and len(words) > MAX_HEADING_WORDS_EXTENDED:
-            return False
-
-        if clean.endswith((".", "?", "!")) and len(words) > 3:
-            return False
+    def _heading_reject_reason(self, text: str, num_lines: int = 1) -> Optional[str]:
+        return self.rules.reject_reason(text, num_lines, self.max_heading_words)
 
-        return True
+    def _should_keep_heading_text(self, text: str, num_lines: int = 1) -> bool:
+        return self._heading_reject_reason(text, num_lines) is None
 
-    def extract(self) -> Dict[str, Any]:
-        if not os.path.exists(self.pdf_path):
+    def _open_document(self) -> Optional[fitz.Document]:
+        if self.pdf_bytes is None and not os.path.exists(self.pdf_path):
             logger.error(f"File not found: {self.pdf_path}")
-            return {"title": "Unknown", "outline": []}
+            return None
 
         try:
-            doc = fitz.open(self.pdf_path)
+            if self.pdf_bytes is not None:
+                doc = fitz.open(stream=self.pdf_bytes, filetype="pdf")
+            else:
+                doc = fitz.open(self.pdf_path)
         except Exception as e:
             logger.error(f"Error opening PDF: {e}")
-            return {"title": "Unknown", "outline": []}
+            return None
 
         if doc.page_count == 0:
             doc.close()
-            return {"title": "Unknown", "outline": []}
+            return None
+        return doc
 
-        self._collect_font_ranks(doc)
-        meta_title = (doc.metadata.get("title") or "").strip() if doc.metadata else ""
-        title_size = -1.0
-
-        page_limit = min(doc.page_count, self.max_pages)
-        for pno in range(page_limit):
-            page = doc[pno]
-            pdata = page.get_text("dict")
-            for block in pdata["blocks"]:
-                lines = block.get("lines", [])
-                if not lines:
-                    continue
+    def _bookmark_outline(self, doc: fitz.Document) -> Optional[List[Heading]]:
+        """Headings from the PDF's bookmark tree, or None if it is missing or untrustworthy.
 
-                # Gather all spans in this block
-                block_spans = []
-                for ln in lines:
-                    block_spans.extend(ln.get("spans", []))
-                if not block_spans:
-                    continue
+        Each entry is checked against the plain text of the page it points to
+        (only those pages are read, and no layout dicts are built). Entries
+        deeper than three levels are folded into H3.
+        """
+        try:
+            toc = doc.get_toc(simple=True)
+        except Exception:
+            return None
+        page_limit = self._page_limit(doc)
+        entries = [(lvl, title, page) for lvl, title, page in toc if 1 <= page <= page_limit and title.strip()]
+        if not entries:
+            return None
+        # Titles are matched in plain form; only the emitted text goes through
+        # the (possibly SentencePiece) normalizer.
+        page_text: Dict[int, str] = {}
+        found = []
+        for lvl, title, page in entries:
+            if page not in page_text:
+                page_text[page] = _match_key(doc.load_page(page - 1).get_text("text"))
+            key = _match_key(title)
+            if key and key in page_text[page]:
+                found.append((lvl, title, page))
+        if len(found) < TOC_MIN_VALID_RATIO * len(entries):
+            logger.info(f"Bookmarks rejected: {len(found)}/{len(entries)} entries found on their pages")
+            return None
+        texts = self._normalize_many([title for _, title, _ in found])
+        return [Heading(f"H{min(lvl, 3)}", text, page) for (lvl, _, page), text in zip(found, texts) if text]
 
-                raw_text = " ".join(s["text"] for s in block_spans)
-                text = self._normalize_text(raw_text)
-                if not text:
-                    continue
+    def _merge_bookmarks(self, bookmarks: List[Heading]) -> None:
+        # Bookmark levels are authored, so they win for headings both sides
+        # found; bookmark-only entries go after the heuristic ones on their page.
+        by_key = {(h.page, _match_key(h.text)): h for h in bookmarks}
+        merged = []
+        for h in self.outline:
+            b = by_key.pop((h.page, _match_key(h.text)), None)
+            merged.append(Heading(b.level, h.text, h.page) if b else h)
+        merged.extend(by_key.values())
+        merged.sort(key=lambda h: h.page)
+        self.outline = merged
+        if self._first_heading is None and merged:
+            self._first_heading = merged[0].text
 
-                sizes = [s["size"] for s in block_spans if s["text"].strip()]
-                sizes_sorted = sorted(sizes)
-                mid = len(sizes_sorted) // 2
-                size = sizes_sorted[mid] if sizes_sorted else block_spans[0]["size"]
+    def _walk_pages(self, doc: fitz.Document) -> None:
+        self.outline.extend(self._iter_page_headings(doc))
 
-                font_name = block_spans[0]["font"]
+    def _iter_page_headings(self, doc: fitz.Document) -> Iterator[Heading]:
+        m = self.metrics
+        rules = self.rules
+        clock = time.perf_counter
+        title_size = -1.0
+        for pno in range(self._page_limit(doc)):
+            if self.adaptive and not self._page_may_have_headings(doc, pno):
+                if m:
+                    m.pages_skipped += 1
+                continue
+            page_start = clock() if m else 0.0
+            table = self._page_blocks(doc, pno)
+            if self.adaptive:
+                self._learn_fonts(table)
+            t0 = clock() if m else 0.0
+            texts = self._normalize_many(table.block_texts())
+            if m:
+                m.add_time("normalize", clock() - t0)
+                m.pages += 1
+                m.blocks += table.n_blocks
+                m.spans += len(table)
 
-                # Detect heading level
-                level = self._size_to_level(size)
-                if level is None:
-                    if is_bold_font(font_name) and not is_italic_font(font_name):
-                        if self.font_ranks and size > self.font_ranks[-1]:
-                            level = "H2"
-                        else:
-                            level = "H3"
+            # Detect heading levels for the whole page at once
+            block_sizes = table.block_median_size()
+            block_levels = self._block_levels(table, block_sizes)
+            font_names = self._fonts.names
+            for text, num_lines, size, font_id, code in zip(
+                texts,
+                table.block_lines.tolist(),
+                block_sizes.tolist(),
+                table.block_first(table.font).tolist(),
+                block_levels.tolist(),
+            ):
+                if not text:
+                    if m:
+                        m.reject("empty")
+                    continue
+                level = LEVEL_NAMES[code]
 
                 # Pattern overrides
-                for rx, forced_level in HEADING_LEVEL_OVERRIDES:
-                    if rx.search(text):
-                        level = forced_level
-                        break
+                t0 = clock() if m else 0.0
+                level = rules.level_for(text) or level
+                if m:
+                    m.add_time("overrides", clock() - t0)
 
                 # Bullet adjustment
-                if BULLET_PREFIX_RE.match(text) and len(text.split()) > 1:
+                bulleted, clean = rules.strip_bullet(text)
+                if bulleted and len(text.split()) > 1:
                     if level == "H1":
                         level = "H2"
                     elif level == "H2":
                         level = "H3"
 
-                if level and self._should_keep_heading_text(text, num_lines=len(lines)):
-                    self.outline.append(Heading(level, text, pno + 1))
+                # One verdict per block, shared by the outline and title checks
+                reason: Any = _UNCHECKED
+                if level:
+                    reason = rules.reject_reason(text, num_lines, self.max_heading_words, clean)
+                    if reason is None:
+                        if self.adaptive:
+                            self._heading_fonts.add(font_names[font_id])
+                        if self._first_heading is None:
+                            self._first_heading = text
+                        yield Heading(level, text, pno + 1)
+                        if m:
+                            m.headings_kept += 1
+                    elif m:
+                        m.reject(reason)
+                elif m:
+                    m.reject("not_heading_font")
 
                 # Title detection
+                t0 = clock() if m else 0.0
                 if pno < self.title_scan_pages and size > title_size:
-                    if self._should_keep_heading_text(text, num_lines=len(lines)):
+                    if reason is _UNCHECKED:
+                        reason = rules.reject_reason(text, num_lines, self.max_heading_words, clean)
+                    if reason is None:
                         self.title = text
                         title_size = size
+                if m:
+                    m.add_time("title", clock() - t0)
+            if m:
+                m.page_seconds.append(clock() - page_start)
+        self._page_cache.clear()
 
+    def extract(self) -> Dict[str, Any]:
+        m = self.metrics
+        start = time.perf_counter()
+        doc = self._open_document()
+        if m:
+            m.add_time("open", time.perf_counter() - start)
+            m.bytes_read = len(self.pdf_bytes) if self.pdf_bytes is not None else (
+                os.path.getsize(self.pdf_path) if os.path.exists(self.pdf_path) else 0
+            )
+        if doc is None:
+            return {"title": "Unknown", "outline": []}
+        meta_title = (doc.metadata.get("title") or "").strip() if doc.metadata else ""
+
+        bookmarks = None
+        if self.toc_mode != "off":
+            t0 = time.perf_counter()
+            bookmarks = self._bookmark_outline(doc)
+            if m:
+                m.add_time("toc", time.perf_counter() - t0)
+            if bookmarks is not None and self.toc_mode == "prefer":
+                doc.close()
+                self.outline = bookmarks
+                self._take_bookmark_title(bookmarks)
+                if m:
+                    m.headings_kept = len(bookmarks)
+                    m.add_time("total", time.perf_counter() - start)
+                return self._result(meta_title)
+
+        t0 = time.perf_counter()
+        self._collect_font_ranks(doc)
+        if m:
+            m.add_time("font_ranks", time.perf_counter() - t0)
+        t0 = time.perf_counter()
+        self._walk_pages(doc)
         doc.close()
+        if bookmarks:
+            self._merge_bookmarks(bookmarks)
+        if m:
+            m.add_time("page_walk", time.perf_counter() - t0)
+            m.add_time("total", time.perf_counter() - start)
+
+        return self._result(meta_title)
+
+    def iter_headings(self) -> Iterator[Heading]:
+        """Stream the outline page by page instead of collecting it.
+
+        Nothing is kept per heading, so memory stays flat however long the
+        document is; ``self.title`` is set once the generator is exhausted.
+        toc_mode "merge" is the exception: merging needs the whole heuristic
+        outline, so it is collected before anything is yielded.
+        """
+        doc = self._open_document()
+        if doc is None:
+            self.title = "Unknown"
+            return
+        try:
+            meta_title = (doc.metadata.get("title") or "").strip() if doc.metadata else ""
+            bookmarks = self._bookmark_outline(doc) if self.toc_mode != "off" else None
+            if bookmarks is not None and self.toc_mode == "prefer":
+                self._take_bookmark_title(bookmarks)
+                yield from bookmarks
+            elif bookmarks:
+                self._collect_font_ranks(doc)
+                self._walk_pages(doc)
+                self._merge_bookmarks(bookmarks)
+                yield from self.outline
+            else:
+                self._collect_font_ranks(doc)
+                yield from self._iter_page_headings(doc)
+        finally:
+            doc.close()
+        self._set_title(meta_title)
+
+    def _take_bookmark_title(self, bookmarks: List[Heading]) -> None:
+        # Trusted bookmarks skip the page walk and with it the title scan; the
+        # shallowest entry stands in for it, ahead of the often machine-made
+        # metadata title.
+        if bookmarks:
+            self.title = min(bookmarks, key=lambda h: h.level).text
+            self._first_heading = bookmarks[0].text
+
+    def _set_title(self, meta_title: str) -> None:
         if not self.title:
-            self.title = meta_title if meta_title else (self.outline[0].text if self.outline else "Unknown")
+            self.title = meta_title if meta_title else (self._first_heading or "Unknown")
+
+    def _result(self, meta_title: str) -> Dict[str, Any]:
+        self._set_title(meta_title)
 
         return {"title": self.title, "outline": [h.__dict__ for h in self.outline]}
 
 
-def process_directory(indir: str, outdir: str) -> int:
-    os.makedirs(outdir, exist_ok=True)
-    pdfs = [f for f in os.listdir(indir) if f.lower().endswith(".pdf")]
+class ExtractionTimeout(BaseException):
+    """Raised inside a worker when a single PDF exceeds its time budget.
+
+    Derives from BaseException so the broad ``except Exception`` guards inside
+    the extractor cannot swallow it.
+    """
+
+
+@dataclass
+class BatchResult:
+    pdf_path: str
+    data: Optional[Dict[str, Any]]
+    error: Optional[str] = None
+    elapsed: float = 0.0
+    metrics: Optional[Dict[str, Any]] = None
+
+
+def _raise_timeout(signum, frame):
+    raise ExtractionTimeout()
+
+
+@contextmanager
+def _time_limit(seconds: Optional[float]):
+    # SIGALRM only fires between bytecodes, so a timeout lands once the current
+    # MuPDF call returns (page granularity). Unavailable on Windows/non-main threads.
+    usable = (
+        seconds
+        and hasattr(signal, "setitimer")
+        and threading.current_thread() is threading.main_thread()
+    )
+    if not usable:
+        yield
+        return
+    previous = signal.signal(signal.SIGALRM, _raise_timeout)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def _extract_guarded(pdf_path: str, timeout: Optional[float], extractor_kwargs: Dict[str, Any]) -> BatchResult:
+    start = time.perf_counter()
+    try:
+        with _time_limit(timeout):
+            extractor = PDFOutlineExtractor(pdf_path, **extractor_kwargs)
+            data = extractor.extract()
+    except ExtractionTimeout:
+        return BatchResult(pdf_path, None, f"timed out after {timeout}s", time.perf_counter() - start)
+    except Exception as e:
+        return BatchResult(pdf_path, None, f"{type(e).__name__}: {e}", time.perf_counter() - start)
+    metrics = extractor.metrics.to_dict() if extractor.metrics else None
+    return BatchResult(pdf_path, data, None, time.perf_counter() - start, metrics)
+
+
+def _init_worker(sp_model_path: Optional[str]) -> None:
+    get_sentencepiece(sp_model_path)
+
+
+def _extract_chunk(
+    chunk: List[Tuple[int, str]], timeout: Optional[float], extractor_kwargs: Dict[str, Any]
+) -> List[Tuple[int, BatchResult]]:
+    return [(idx, _extract_guarded(path, timeout, extractor_kwargs)) for idx, path in chunk]
+
+
+def iter_batch(
+    pdf_paths: Sequence[str],
+    workers: Optional[int] = None,
+    chunksize: int = 4,
+    timeout: Optional[float] = None,
+    ordered: bool = True,
+    **extractor_kwargs: Any,
+) -> Iterator[BatchResult]:
+    """Extract outlines for many PDFs on a process pool, streaming results.
+
+    Work is handed out in chunks of ``chunksize`` files with at most two chunks
+    in flight per worker. With ``ordered`` results come back in input order,
+    otherwise as soon as they complete. Failures, timeouts and worker crashes
+    are reported as a ``BatchResult`` with ``error`` set; they never abort the
+    batch.
+    """
+    workers = workers or os.cpu_count() or 1
+    chunksize = max(1, chunksize)
+    indexed = list(enumerate(pdf_paths))
+
+    if workers == 1:
+        for _, path in indexed:
+            yield _extract_guarded(path, timeout, extractor_kwargs)
+        return
+
+    # Load shared models before forking so workers inherit them.
+    get_sentencepiece(extractor_kwargs.get("sp_model_path"))
+
+    # A worker that dies (e.g. MuPDF segfault) breaks the whole pool. Files that
+    # were in flight are then retried one at a time, and a crash in isolation
+    # is attributed to that file. Entries are (chunk, isolated).
+    todo = deque((indexed[i:i + chunksize], False) for i in range(0, len(indexed), chunksize))
+    buffered: Dict[int, BatchResult] = {}
+    next_idx = 0
+
+    def emit(results: List[Tuple[int, BatchResult]]) -> Iterator[BatchResult]:
+        nonlocal next_idx
+        if not ordered:
+            for _, res in results:
+                yield res
+            return
+        buffered.update(results)
+        while next_idx in buffered:
+            yield buffered.pop(next_idx)
+            next_idx += 1
+
+    while todo:
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(extractor_kwargs.get("sp_model_path"),),
+        ) as pool:
+            inflight: Dict[Any, Tuple[List[Tuple[int, str]], bool]] = {}
+            crashed: List[Tuple[List[Tuple[int, str]], bool]] = []
+            while (todo or inflight) and not crashed:
+                while todo and len(inflight) < workers * 2:
+                    chunk, isolated = todo[0]
+                    if isolated and inflight:
+                        break
+                    todo.popleft()
+                    fut = pool.submit(_extract_chunk, chunk, timeout, extractor_kwargs)
+                    inflight[fut] = (chunk, isolated)
+                    if isolated:
+                        break
+                done, _ = wait(inflight, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    chunk, isolated = inflight.pop(fut)
+                    try:
+                        results = fut.result()
+                    except BrokenProcessPool:
+                        crashed.append((chunk, isolated))
+                        continue
+                    except Exception as e:
+                        results = [(idx, BatchResult(path, None, f"{type(e).__name__}: {e}")) for idx, path in chunk]
+                    yield from emit(results)
+            if crashed:
+                # Every other in-flight future fails with the pool; keep what finished.
+                for fut, (chunk, isolated) in inflight.items():
+                    try:
+                        results = fut.result()
+                    except Exception:
+                        crashed.append((chunk, isolated))
+                        continue
+                    yield from emit(results)
+
+        retry = []
+        for chunk, isolated in crashed:
+            for idx, path in chunk:
+                if isolated:
+                    logger.error(f"Worker crashed on {path}")
+                    yield from emit([(idx, BatchResult(path, None, "worker process crashed"))])
+                else:
+                    retry.append(([(idx, path)], True))
+        todo.extendleft(reversed(retry))
+
+
+def _write_json(data: Dict[str, Any], out_path: str) -> None:
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+
+
+class DirectorySink:
+    """One pretty-printed JSON file per PDF, each written atomically.
+
+    Files are not synced as they are written; flush() makes everything written
+    since the last call durable.
+    """
+
+    def __init__(self, outdir: str, resume: bool = False):
+        self.outdir = outdir
+        os.makedirs(outdir, exist_ok=True)
+        self.done = set()
+        self._unsynced: List[str] = []
+        if resume:
+            self.done = {
+                os.path.splitext(f)[0] + ".pdf" for f in os.listdir(outdir) if f.endswith(".json")
+            }
+
+    def is_done(self, fname: str) -> bool:
+        return os.path.splitext(fname)[0] + ".pdf" in self.done
+
+    def write(self, fname: str, data: Dict[str, Any]) -> str:
+        out_path = os.path.join(self.outdir, os.path.splitext(fname)[0] + ".json")
+        tmp = out_path + ".tmp"
+        _write_json(data, tmp)
+        os.replace(tmp, out_path)
+        self._unsynced.append(out_path)
+        return out_path
+
+    def flush(self) -> None:
+        """Make every file written so far, and its directory entry, durable."""
+        if not self._unsynced:
+            return
+        for path in self._unsynced:
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        if hasattr(os, "O_DIRECTORY"):  # directories cannot be synced on Windows
+            fd = os.open(self.outdir, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        self._unsynced = []
+
+    def close(self) -> None:
+        pass
+
+
+class JsonlSink:
+    """All results in one JSONL file (gzip-compressed if it ends in .gz).
+
+    Each record is ``{"file": <pdf name>, "title": ..., "outline": [...]}`` on
+    its own line, written with a single write call. With ``resume`` the file is
+    cut back to its last complete record and the files it already holds are
+    skipped; otherwise it is started fresh.
+    """
+
+    def __init__(self, path: str, resume: bool = False, flush_every: int = 100):
+        self.path = path
+        self.compressed = path.endswith(".gz")
+        self.flush_every = flush_every
+        self.done = set()
+        self._pending = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        if resume and os.path.exists(path):
+            self._recover()
+        elif os.path.exists(path):
+            os.remove(path)
+        self._fh = gzip.open(path, "at", encoding="utf-8") if self.compressed else open(path, "a", encoding="utf-8")
+
+    # Bytes read per step when looking backwards for the last complete record.
+    RECOVER_BLOCK = 1 << 16
+
+    def _recover(self) -> None:
+        if self.compressed:
+            self._recover_gzip()
+        else:
+            self._recover_plain()
+        logger.info(f"Resuming {self.path}: {len(self.done)} records kept")
+
+    def _note(self, line: str) -> None:
+        try:
+            self.done.add(json.loads(line)["file"])
+        except (ValueError, KeyError):
+            pass
+
+    def _recover_plain(self) -> None:
+        # Cut after the last newline, found by reading backwards from EOF.
+        with open(self.path, "rb+") as f:
+            end = f.seek(0, os.SEEK_END)
+            while end > 0:
+                start = max(0, end - self.RECOVER_BLOCK)
+                f.seek(start)
+                nl = f.read(end - start).rfind(b"\n")
+                if nl >= 0:
+                    end = start + nl + 1
+                    break
+                end = start
+            f.truncate(end)
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                self._note(line)
+
+    def _gzip_lines(self, state: Dict[str, bool]) -> Iterator[bytes]:
+        """Complete lines of the gzip file, up to the first damaged or missing byte.
+
+        ``state["clean"]`` ends up False if anything after them was dropped.
+        """
+        state["clean"] = False
+        with open(self.path, "rb") as f:
+            inflate, tail, fed = zlib.decompressobj(31), b"", False
+            while True:
+                chunk = f.read(self.RECOVER_BLOCK)
+                if not chunk:
+                    break
+                while chunk:
+                    try:
+                        data = inflate.decompress(chunk)
+                    except zlib.error:
+                        return
+                    fed = True
+                    lines = (tail + data).split(b"\n")
+                    tail = lines.pop()
+                    for line in lines:
+                        yield line + b"\n"
+                    chunk = b""
+                    if inflate.eof:  # next member (one per append session)
+                        chunk, inflate, fed = inflate.unused_data, zlib.decompressobj(31), False
+            state["clean"] = not fed and not tail
+
+    def _recover_gzip(self) -> None:
+        # A gzip member cut off mid-write cannot be appended to, so copy the
+        # readable records to a new file. Both passes stream.
+        state: Dict[str, bool] = {}
+        good = 0
+        for line in self._gzip_lines(state):
+            self._note(line.decode("utf-8"))
+            good += 1
+        if not state["clean"]:
+            tmp = self.path + ".tmp"
+            with gzip.open(tmp, "wb") as dst:
+                dst.writelines(islice(self._gzip_lines({}), good))
+            os.replace(tmp, self.path)
+
+    def is_done(self, fname: str) -> bool:
+        return fname in self.done
+
+    def write(self, fname: str, data: Dict[str, Any]) -> str:
+        self._fh.write(json.dumps({"file": fname, **data}, ensure_ascii=False, separators=(",", ":")) + "\n")
+        self._pending += 1
+        if self._pending >= self.flush_every:
+            self._fh.flush()
+            self._pending = 0
+        return self.path
+
+    def flush(self) -> None:
+        """Make every record written so far durable."""
+        self._fh.flush()
+        os.fsync(self._fh.fileno())
+        self._pending = 0
+
+    def close(self) -> None:
+        self._fh.close()
+
+
+def _file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class BatchManifest:
+    """Per-input record of what was extracted, for incremental batch runs.
+
+    Entries (path, size, mtime, sha256, config, output) are appended to a JSONL
+    file as PDFs are written, so an interrupted run resumes where it stopped;
+    the last entry for a path wins. close() compacts the file.
+
+    stage() holds an entry back until commit(), so the caller can make a group
+    of outputs durable first and the manifest never vouches for a record that
+    a crash could still lose.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.staged: List[Dict[str, Any]] = []
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        self.entries[entry["path"]] = entry
+                    except (ValueError, KeyError):
+                        continue  # torn last line from an interrupted run
+        self._fh = open(path, "a", encoding="utf-8")
+
+    def is_current(self, fname: str, pdf_path: str, config: str) -> bool:
+        entry = self.entries.get(fname)
+        if not entry or entry.get("config") != config or not os.path.exists(entry.get("output", "")):
+            return False
+        st = os.stat(pdf_path)
+        if entry["size"] == st.st_size and entry["mtime"] == st.st_mtime:
+            return True
+        # Touched but maybe not changed: fall back to the content hash.
+        if entry["size"] == st.st_size and entry["sha256"] == _file_sha256(pdf_path):
+            self.record(fname, pdf_path, config, entry["output"], sha256=entry["sha256"])
+            return True
+        return False
+
+    @staticmethod
+    def _entry(fname: str, pdf_path: str, config: str, output: str, sha256: Optional[str] = None) -> Dict[str, Any]:
+        st = os.stat(pdf_path)
+        return {
+            "path": fname,
+            "size": st.st_size,
+            "mtime": st.st_mtime,
+            "sha256": sha256 or _file_sha256(pdf_path),
+            "config": config,
+            "output": output,
+        }
+
+    def record(self, fname: str, pdf_path: str, config: str, output: str, sha256: Optional[str] = None) -> None:
+        """Append an entry for output that is already durable."""
+        self.staged.append(self._entry(fname, pdf_path, config, output, sha256))
+        self.commit()
+
+    def stage(self, fname: str, pdf_path: str, config: str, output: str) -> None:
+        """Queue an entry until commit(); call that once ``output`` is durable."""
+        self.staged.append(self._entry(fname, pdf_path, config, output))
+
+    def commit(self) -> None:
+        if not self.staged:
+            return
+        for entry in self.staged:
+            self.entries[entry["path"]] = entry
+        self._fh.write("".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in self.staged))
+        self._fh.flush()
+        self.staged = []
+
+    def close(self, keep: Optional[Sequence[str]] = None) -> None:
+        self._fh.close()
+        if keep is not None:
+            keep = set(keep)
+            self.entries = {k: v for k, v in self.entries.items() if k in keep}
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for entry in self.entries.values():
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        os.replace(tmp, self.path)
+
+
+# Incremental runs sync the output and append the staged manifest entries
+# after this many PDFs, or this many seconds, whichever comes first.
+MANIFEST_COMMIT_EVERY = 100
+MANIFEST_COMMIT_SECONDS = 5.0
+
+
+def default_manifest_path(outdir: str, jsonl: bool) -> str:
+    return outdir + ".manifest.jsonl" if jsonl else os.path.join(outdir, "manifest.jsonl")
+
+
+def process_directory(
+    indir: str,
+    outdir: str,
+    workers: Optional[int] = 1,
+    chunksize: int = 4,
+    timeout: Optional[float] = None,
+    ordered: bool = True,
+    jsonl: bool = False,
+    resume: bool = False,
+    incremental: bool = False,
+    manifest_path: Optional[str] = None,
+    metrics_path: Optional[str] = None,
+    **extractor_kwargs: Any,
+) -> int:
+    """Extract every PDF in ``indir``.
+
+    Results go to one JSON file per PDF in ``outdir``, or, with ``jsonl``, to
+    the single JSONL file ``outdir`` (gzip if it ends in .gz).
+
+    With ``incremental`` a manifest decides what to skip: a PDF is extracted
+    again only if its content or the extractor configuration changed since it
+    was last written. In JSONL output a re-extracted PDF gets a new record;
+    the last record for a file is the current one.
+
+    ``metrics_path`` turns on instrumentation: per-document metrics and their
+    aggregate are written there as JSON, and the aggregate in Prometheus text
+    format next to it (``.prom``).
+    """
+    aggregate = MetricsAggregate() if metrics_path else None
+    doc_metrics: List[Dict[str, Any]] = []
+    if metrics_path:
+        extractor_kwargs["instrument"] = True
+    pdfs = sorted(f for f in os.listdir(indir) if f.lower().endswith(".pdf"))
+    manifest = None
+    if incremental:
+        sink = JsonlSink(outdir, resume=True) if jsonl else DirectorySink(outdir, resume=True)
+        manifest = BatchManifest(manifest_path or default_manifest_path(outdir, jsonl))
+        config = PDFOutlineExtractor("", **extractor_kwargs).config_fingerprint()
+        # The manifest only counts if the output still holds the record.
+        todo = [
+            f for f in pdfs
+            if not (sink.is_done(f) and manifest.is_current(f, os.path.join(indir, f), config))
+        ]
+    else:
+        sink = JsonlSink(outdir, resume=resume) if jsonl else DirectorySink(outdir, resume=resume)
+        todo = [f for f in pdfs if not sink.is_done(f)]
+    if len(todo) < len(pdfs):
+        logger.info(f"Skipping {len(pdfs) - len(todo)} PDFs already written")
+    paths = [os.path.join(indir, fname) for fname in todo]
     count = 0
-    for fname in pdfs:
-        pdf_path = os.path.join(indir, fname)
-        base = os.path.splitext(fname)[0] + ".json"
-        out_path = os.path.join(outdir, base)
-        extractor = PDFOutlineExtractor(pdf_path)
-        data = extractor.extract()
-        with open(out_path, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
-        count += 1
-        logger.info(f"Wrote {out_path}")
+    last_commit = time.monotonic()
+    results = iter_batch(
+        paths, workers=workers, chunksize=chunksize, timeout=timeout, ordered=ordered, **extractor_kwargs
+    )
+    try:
+        for res in results:
+            if aggregate:
+                aggregate.add(res.metrics, failed=bool(res.error))
+                if res.metrics:
+                    doc_metrics.append(res.metrics)
+            if res.error:
+                logger.error(f"Failed {res.pdf_path}: {res.error}")
+                continue
+            fname = os.path.basename(res.pdf_path)
+            out_path = sink.write(fname, res.data)
+            if manifest:
+                # Records must be on disk before the manifest vouches for them.
+                manifest.stage(fname, res.pdf_path, config, out_path)
+                if (
+                    len(manifest.staged) >= MANIFEST_COMMIT_EVERY
+                    or time.monotonic() - last_commit >= MANIFEST_COMMIT_SECONDS
+                ):
+                    sink.flush()
+                    manifest.commit()
+                    last_commit = time.monotonic()
+            count += 1
+            logger.info(f"Wrote {os.path.basename(res.pdf_path)} to {out_path} ({res.elapsed:.2f}s)")
+    finally:
+        if manifest:
+            sink.flush()
+            manifest.commit()
+        sink.close()
+        if manifest:
+            manifest.close(keep=pdfs)
+        if aggregate:
+            write_metrics(metrics_path, aggregate, doc_metrics)
     return count
 
 
-def _usage():
-    print("Usage:")
-    print("  python extract_outline.py <pdf_path> [output.json]")
-    print("  python extract_outline.py --batch <input_dir> <output_dir>")
-    sys.exit(1)
+def write_metrics(path: str, aggregate: MetricsAggregate, documents: Sequence[Dict[str, Any]] = ()) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"aggregate": aggregate.to_dict(), "documents": list(documents)}, f, ensure_ascii=False)
+    with open(os.path.splitext(path)[0] + ".prom", "w", encoding="utf-8") as f:
+        f.write(aggregate.to_prometheus())
+    logger.info(f"Metrics written to {path}")
+
+
+def _build_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="extract_pdf.py",
+        description="Extract a title and H1-H3 outline from PDF files.",
+    )
+    parser.add_argument("pdf_path", nargs="?", help="single PDF to process")
+    parser.add_argument("out_path", nargs="?", default="output/output.json", help="output JSON path")
+    parser.add_argument("--batch", nargs=2, metavar=("INPUT_DIR", "OUTPUT"), help="process every PDF in a directory")
+    parser.add_argument("--workers", type=int, default=None, help="batch worker processes (default: CPU count)")
+    parser.add_argument("--chunksize", type=int, default=4, help="PDFs handed to a worker at a time")
+    parser.add_argument("--timeout", type=float, default=None, help="per-PDF time limit in seconds")
+    parser.add_argument("--max-pages", type=int, default=None, help="pages to scan, 0 for all (default: 50, all with --adaptive)")
+    parser.add_argument("--adaptive", action="store_true", help="pre-scan page fonts and decode only likely heading pages")
+    parser.add_argument(
+        "--toc", choices=TOC_MODES, default="off",
+        help="use the PDF's bookmarks: 'prefer' them when they match the page text, or 'merge' with the heuristic",
+    )
+    parser.add_argument("--overrides", default=None, help="JSON file of extra heading level override patterns")
+    parser.add_argument("--max-rss-mb", type=int, default=None, help="fail a PDF once the process RSS exceeds this")
+    parser.add_argument("--sp-model", default=None, help="SentencePiece model for multilingual normalization")
+    parser.add_argument("--unordered", action="store_true", help="write batch results as they complete")
+    parser.add_argument("--jsonl", action="store_true", help="batch OUTPUT is a single JSONL file (.gz to compress)")
+    parser.add_argument("--resume", action="store_true", help="keep existing batch output and skip PDFs already in it")
+    parser.add_argument("--incremental", action="store_true", help="use a manifest to skip unchanged PDFs")
+    parser.add_argument("--manifest", default=None, help="manifest path for --incremental")
+    parser.add_argument("--metrics", default=None, help="write extraction metrics (JSON, plus .prom) to this path")
+    return parser
 
 
 if __name__ == "__main__":
-    args: Sequence[str] = sys.argv[1:]
-    if not args:
-        _usage()
-
-    if args[0] == "--batch":
-        if len(args) != 3:
-            _usage()
-        n = process_directory(args[1], args[2])
+    parser = _build_arg_parser()
+    opts = parser.parse_args()
+    max_pages = opts.max_pages if opts.max_pages is not None else (0 if opts.adaptive else 50)
+    extractor_kwargs = {
+        "sp_model_path": opts.sp_model,
+        "max_rss_mb": opts.max_rss_mb,
+        "max_pages": max_pages or None,
+        "adaptive": opts.adaptive,
+        "toc_mode": opts.toc,
+        "rules": HeadingRules.from_json(opts.overrides) if opts.overrides else None,
+    }
+
+    if opts.batch:
+        n = process_directory(
+            opts.batch[0],
+            opts.batch[1],
+            workers=opts.workers,
+            chunksize=opts.chunksize,
+            timeout=opts.timeout,
+            ordered=not opts.unordered,
+            jsonl=opts.jsonl,
+            resume=opts.resume,
+            incremental=opts.incremental,
+            manifest_path=opts.manifest,
+            metrics_path=opts.metrics,
+            **extractor_kwargs,
+        )
         logger.info(f"Processed {n} PDFs.")
         sys.exit(0)
 
-    pdf_path = args[0]
-    out_path = args[1] if len(args) > 1 else "output/output.json"
-    extractor = PDFOutlineExtractor(pdf_path)
+    if not opts.pdf_path:
+        parser.print_usage()
+        sys.exit(1)
+
+    extractor = PDFOutlineExtractor(opts.pdf_path, **extractor_kwargs)
     result = extractor.extract()
-    os.makedirs(os.path.dirname(out_path), exist_ok=True)
-    with open(out_path, "w", encoding="utf-8") as f:
-        json.dump(result, f, indent=2, ensure_ascii=False)
-    print(json.dumps(result, indent=2, ensure_ascii=False))
\ No newline at end of file
+    os.makedirs(os.path.dirname(opts.out_path) or ".", exist_ok=True)
+    _write_json(result, opts.out_path)
+    print(json.dumps(result, indent=2, ensure_ascii=False))
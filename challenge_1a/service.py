@@ -0,0 +1,234 @@
+"""Long-running outline extraction service.
+
+Keeps a pool of warm worker processes (PyMuPDF imported, SentencePiece model
+loaded) and serves requests over HTTP or a Unix socket:
+
+    python service.py --port 8080
+    python service.py --socket /tmp/outline.sock
+
+    POST /outline   JSON {"path": "..."} or a raw PDF body (application/pdf)
+    GET  /health    pool and queue status
+    GET  /metrics   extraction counters and timings (Prometheus text; JSON
+                    from /metrics.json)
+
+Concurrency is bounded by the number of workers; up to --max-queue further
+requests wait for a worker and anything beyond that is rejected with 503.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import socketserver
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional, Tuple
+
+from extract_pdf import TOC_MODES, MetricsAggregate, _extract_guarded, _init_worker, get_sentencepiece, logger
+
+MAX_UPLOAD_BYTES = 200 * 1024 * 1024
+# The header may follow up to this many bytes of leading junk.
+PDF_HEADER_WINDOW = 1024
+
+
+def looks_like_pdf(head: bytes) -> bool:
+    return b"%PDF-" in head[:PDF_HEADER_WINDOW]
+
+
+class Overloaded(Exception):
+    pass
+
+
+class ExtractionPool:
+    """Process pool with admission control: workers + max_queue requests at most."""
+
+    def __init__(self, workers: int, max_queue: int, timeout: Optional[float], extractor_kwargs: Dict[str, Any]):
+        self.workers = workers
+        self.capacity = workers + max_queue
+        self.timeout = timeout
+        self.extractor_kwargs = extractor_kwargs
+        self._lock = threading.Lock()
+        self._admitted = 0
+        self.metrics = MetricsAggregate()
+        get_sentencepiece(extractor_kwargs.get("sp_model_path"))
+        self._pool = self._new_pool()
+
+    def _new_pool(self) -> ProcessPoolExecutor:
+        # Pools are created and restarted from handler threads; forking a
+        # threaded process can leave a child stuck on a lock some other thread
+        # held, so workers start from a clean server process instead.
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(self.extractor_kwargs.get("sp_model_path"),),
+        )
+
+    def status(self) -> Dict[str, int]:
+        with self._lock:
+            admitted = self._admitted
+        return {
+            "workers": self.workers,
+            "busy": min(admitted, self.workers),
+            "queued": max(0, admitted - self.workers),
+            "capacity": self.capacity,
+        }
+
+    def extract(self, label: str, pdf_bytes: Optional[bytes] = None) -> Tuple[Optional[Dict[str, Any]], Optional[str], float]:
+        with self._lock:
+            if self._admitted >= self.capacity:
+                raise Overloaded()
+            self._admitted += 1
+            pool = self._pool
+        try:
+            kwargs = dict(self.extractor_kwargs, pdf_bytes=pdf_bytes, instrument=True)
+            res = pool.submit(_extract_guarded, label, self.timeout, kwargs).result()
+            self.metrics.add(res.metrics, failed=bool(res.error))
+            return res.data, res.error, res.elapsed
+        except BrokenProcessPool:
+            with self._lock:
+                if self._pool is pool:
+                    logger.error("Worker process crashed; restarting pool")
+                    self._pool = self._new_pool()
+            self.metrics.add(None, failed=True)
+            return None, "worker process crashed", 0.0
+        finally:
+            with self._lock:
+                self._admitted -= 1
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+class OutlineHandler(BaseHTTPRequestHandler):
+    server_version = "OutlineService/1.0"
+
+    def address_string(self) -> str:
+        # Unix-socket peers have no address tuple
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format: str, *args: Any) -> None:
+        logger.info(f"{self.address_string()} {format % args}")
+
+    def _send_json(self, status: int, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        if self.path == "/health":
+            self._send_json(200, {"status": "ok", **self.server.pool.status()})
+        elif self.path == "/metrics.json":
+            self._send_json(200, self.server.pool.metrics.to_dict())
+        elif self.path == "/metrics":
+            body = self.server.pool.metrics.to_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self) -> None:
+        if self.path != "/outline":
+            self._send_json(404, {"error": "not found"})
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        if length <= 0 or length > MAX_UPLOAD_BYTES:
+            self._send_json(400 if length <= 0 else 413, {"error": "missing or oversized body"})
+            return
+        body = self.rfile.read(length)
+
+        if self.headers.get("Content-Type", "").startswith("application/json"):
+            try:
+                label, pdf_bytes = json.loads(body)["path"], None
+            except (ValueError, KeyError, TypeError):
+                self._send_json(400, {"error": 'expected JSON {"path": "..."}'})
+                return
+            if not os.path.isfile(label):
+                self._send_json(404, {"error": f"file not found: {label}"})
+                return
+            with open(label, "rb") as f:
+                head = f.read(PDF_HEADER_WINDOW)
+        else:
+            label, pdf_bytes = "<upload>", body
+            head = body
+        if not looks_like_pdf(head):
+            self._send_json(415, {"error": "not a PDF"})
+            return
+
+        try:
+            data, error, elapsed = self.server.pool.extract(label, pdf_bytes)
+        except Overloaded:
+            self._send_json(503, {"error": "server busy"}, {"Retry-After": "1"})
+            return
+        if error:
+            self._send_json(500, {"error": error})
+            return
+        self._send_json(200, data, {"X-Extraction-Seconds": f"{elapsed:.4f}"})
+
+
+class OutlineHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Any, pool: ExtractionPool):
+        self.pool = pool
+        super().__init__(address, OutlineHandler)
+
+
+class OutlineUnixServer(OutlineHTTPServer):
+    address_family = socket.AF_UNIX
+
+    def server_bind(self) -> None:
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+        socketserver.TCPServer.server_bind(self)
+        self.server_name = "localhost"
+        self.server_port = 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serve PDF outline extraction over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--socket", default=None, help="listen on a Unix socket instead of TCP")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--max-queue", type=int, default=64, help="requests allowed to wait for a worker")
+    parser.add_argument("--timeout", type=float, default=60.0, help="per-PDF time limit in seconds")
+    parser.add_argument("--sp-model", default=None, help="SentencePiece model for multilingual normalization")
+    parser.add_argument("--toc", choices=TOC_MODES, default="off", help="use PDF bookmarks (see extract_pdf.py --toc)")
+    opts = parser.parse_args()
+
+    pool = ExtractionPool(
+        workers=opts.workers or os.cpu_count() or 1,
+        max_queue=opts.max_queue,
+        timeout=opts.timeout,
+        extractor_kwargs={"sp_model_path": opts.sp_model, "toc_mode": opts.toc},
+    )
+    if opts.socket:
+        server: OutlineHTTPServer = OutlineUnixServer(opts.socket, pool)
+        logger.info(f"Listening on unix:{opts.socket}")
+    else:
+        server = OutlineHTTPServer((opts.host, opts.port), pool)
+        logger.info(f"Listening on http://{opts.host}:{opts.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        pool.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""Columnar span table for layout analysis.
+
+PyMuPDF hands text back as nested dicts ("blocks" -> "lines" -> "spans").
+``SpanTable.from_page`` flattens one page into parallel NumPy columns, one row
+per span, so heading detection can work on whole pages at once:
+
+    size        float64   font size as reported by MuPDF
+    flags       int32     MuPDF span flags (bold, italic, superscript, ...)
+    bbox        float32   (n, 4) x0, y0, x1, y1
+    font        int32     id into the document's FontTable
+    page        int32     0-based page number
+    block       int32     row of the span's block (0..n_blocks-1)
+    line        int32     row of the span's line (0..n_lines-1)
+    text_start  int32     span text is text[text_start:text_end]
+    text_end    int32
+    nonblank    bool      span text is not whitespace only
+
+Span texts live in one string, each block's spans separated by a single
+space, so ``text[block_text_start:block_text_end]`` is the block's spans
+joined with " " without building a list per block. ``block_start`` and
+``line_start`` are offsets (length n_blocks+1 / n_lines+1) into the rows.
+Blocks and lines without spans are dropped; ``block_lines`` keeps each
+block's original line count.
+
+This module exists in challenge_1a and challenge_1b/src; keep both copies
+the same.
+"""
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+
+class FontTable:
+    """Interned font names for one document; span rows refer to them by id."""
+
+    def __init__(self) -> None:
+        self.names: List[str] = []
+        self._ids: Dict[str, int] = {}
+        self._masks: Dict[Any, np.ndarray] = {}
+
+    def intern(self, name: str) -> int:
+        fid = self._ids.get(name)
+        if fid is None:
+            fid = self._ids[name] = len(self.names)
+            self.names.append(name)
+        return fid
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def mask(self, predicate: Callable[[str], bool]) -> np.ndarray:
+        """Boolean array over font ids, ``predicate(name)`` per font (cached)."""
+        cached = self._masks.get(predicate)
+        if cached is None or len(cached) != len(self.names):
+            cached = np.fromiter((predicate(n) for n in self.names), dtype=bool, count=len(self.names))
+            self._masks[predicate] = cached
+        return cached
+
+
+class SpanTable:
+    __slots__ = (
+        "fonts", "text", "size", "flags", "bbox", "font", "page", "block", "line",
+        "text_start", "text_end", "nonblank", "block_start", "block_lines",
+        "block_text_start", "block_text_end", "line_start",
+    )
+
+    @classmethod
+    def from_page(cls, page_dict: Dict[str, Any], pno: int, fonts: FontTable) -> "SpanTable":
+        """Build the table from ``page.get_text("dict")`` output."""
+        blocks = [b for b in page_dict["blocks"] if b.get("lines")]
+        line_counts = [sum(1 for ln in b["lines"] if ln["spans"]) for b in blocks]
+        line_spans = [ln["spans"] for b in blocks for ln in b["lines"] if ln["spans"]]
+        spans = [s for group in line_spans for s in group]
+        texts = [s["text"] for s in spans]
+        names = [s["font"] for s in spans]
+        ids = {name: fonts.intern(name) for name in set(names)}
+
+        table = cls.__new__(cls)
+        table.fonts = fonts
+        n = len(spans)
+        table.size = np.array([s["size"] for s in spans], dtype=np.float64)
+        table.flags = np.array([s["flags"] for s in spans], dtype=np.int32)
+        table.bbox = np.array([s["bbox"] for s in spans], dtype=np.float32).reshape(n, 4)
+        table.font = np.array([ids[name] for name in names], dtype=np.int32)
+        table.page = np.full(n, pno, dtype=np.int32)
+        table.nonblank = np.array([bool(t.strip()) for t in texts], dtype=bool)
+
+        line_counts_arr = np.array(line_counts, dtype=np.int32)
+        kept = line_counts_arr > 0
+        table.block_lines = np.array([len(b["lines"]) for b in blocks], dtype=np.int32)[kept]
+        spans_per_line = np.array([len(group) for group in line_spans], dtype=np.int32)
+        table.line_start = np.concatenate(([0], np.cumsum(spans_per_line))).astype(np.int32)
+        table.line = np.repeat(np.arange(len(line_spans), dtype=np.int32), spans_per_line)
+        block_of_line = np.repeat(np.arange(int(kept.sum()), dtype=np.int32), line_counts_arr[kept])
+        table.block = block_of_line[table.line]
+        table.block_start = np.concatenate(([0], np.cumsum(np.bincount(table.block, minlength=len(table.block_lines))))).astype(np.int32)
+
+        # Every span is followed by one separator: " " inside a block, "\n"
+        # between blocks.
+        bounds = table.block_start.tolist()
+        table.text = "\n".join(" ".join(texts[a:b]) for a, b in zip(bounds, bounds[1:]))
+        lengths = np.array([len(t) for t in texts], dtype=np.int32)
+        table.text_start = (np.cumsum(lengths + 1) - (lengths + 1)).astype(np.int32)
+        table.text_end = table.text_start + lengths
+        table.block_text_start = table.text_start[table.block_start[:-1]]
+        table.block_text_end = table.text_end[table.block_start[1:] - 1]
+        return table
+
+    def __len__(self) -> int:
+        return len(self.size)
+
+    @property
+    def n_blocks(self) -> int:
+        return len(self.block_lines)
+
+    @property
+    def n_lines(self) -> int:
+        return len(self.line_start) - 1
+
+    def span_text(self, i: int) -> str:
+        return self.text[self.text_start[i]:self.text_end[i]]
+
+    def block_texts(self) -> List[str]:
+        """Each block's span texts joined with " "."""
+        text = self.text
+        return [text[s:e] for s, e in zip(self.block_text_start.tolist(), self.block_text_end.tolist())]
+
+    def line_texts(self) -> List[str]:
+        """Each line's stripped span texts joined with " ", then stripped."""
+        text = self.text
+        starts, ends = self.text_start.tolist(), self.text_end.tolist()
+        bounds = self.line_start.tolist()
+        return [
+            " ".join(text[starts[i]:ends[i]].strip() for i in range(a, b)).strip()
+            for a, b in zip(bounds, bounds[1:])
+        ]
+
+    def block_first(self, column: np.ndarray) -> np.ndarray:
+        """Value of ``column`` for the first span of every block."""
+        return column[self.block_start[:-1]]
+
+    def line_last(self, column: np.ndarray) -> np.ndarray:
+        """Value of ``column`` for the last span of every line."""
+        return column[self.line_start[1:] - 1]
+
+    def block_median_size(self, mask: Optional[np.ndarray] = None) -> np.ndarray:
+        """Upper median span size per block over rows in ``mask`` (default: nonblank).
+
+        Blocks with no such row get their first span's size.
+        """
+        mask = self.nonblank if mask is None else mask
+        out = self.block_first(self.size).copy()
+        if not mask.any():
+            return out
+        blk, sz = self.block[mask], self.size[mask]
+        order = np.lexsort((sz, blk))
+        counts = np.bincount(blk, minlength=self.n_blocks)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        has = counts > 0
+        out[has] = sz[order][starts[has] + counts[has] // 2]
+        return out
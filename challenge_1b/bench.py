@@ -0,0 +1,151 @@
+"""CPU micro-benchmarks for the 1b pipeline.
+
+    python bench.py embed [--batch-sizes 1,8,32,64] [--repeat 3]
+    python bench.py backends [--backends torch,int8,onnx] [--min-cosine 0.99]
+    python bench.py ann [--rows 200000] [--queries 200] [--nprobe 1,4,8,16,32]
+
+Sections for "embed" and "backends" are taken from the PDFs in input/ so the length
+distribution matches real runs. "backends" also checks each backend's
+embeddings against full-precision torch and exits non-zero if any section's
+cosine falls below --min-cosine. "ann" compares the section index's IVF search
+against exact search on synthetic clustered embeddings.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from src.parser import extract_text_sections
+
+INPUT_DIR = os.path.join(os.getcwd(), "input")
+
+
+def load_section_texts(input_dir=INPUT_DIR):
+    texts = []
+    for file in sorted(os.listdir(input_dir)):
+        if file.endswith(".pdf"):
+            texts.extend(s["text"] for s in extract_text_sections(os.path.join(input_dir, file)))
+    return texts
+
+
+def _timed(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_embed(texts, batch_sizes, repeat):
+    from src import ranker
+
+    print(f"{len(texts)} sections")
+    baseline = _timed(lambda: [ranker.embed_texts([t]) for t in texts], repeat)
+    print(f"  one-by-one       {len(texts) / baseline:10.1f} sections/s")
+    for bs in batch_sizes:
+        elapsed = _timed(lambda: ranker.embed_texts(texts, batch_size=bs), repeat)
+        print(f"  batch_size={bs:<5d} {len(texts) / elapsed:10.1f} sections/s  ({baseline / elapsed:.1f}x)")
+
+
+def bench_backends(texts, names, batch_size, repeat, min_cosine):
+    from src import ranker
+
+    reference = ranker.normalize_rows(ranker.embed_texts(texts, batch_size=batch_size, backend="torch").numpy())
+    print(f"{len(texts)} sections, batch_size={batch_size}")
+    baseline = None
+    ok = True
+    for name in names:
+        start = time.perf_counter()
+        ranker.get_backend(name)
+        setup = time.perf_counter() - start
+        vectors = ranker.normalize_rows(ranker.embed_texts(texts, batch_size=batch_size, backend=name).numpy())
+        cosine = np.sum(vectors * reference, axis=1)
+        elapsed = _timed(lambda: ranker.embed_texts(texts, batch_size=batch_size, backend=name), repeat)
+        baseline = baseline or elapsed
+        ok = ok and bool(cosine.min() >= min_cosine)
+        print(f"  {name:<6s} {len(texts) / elapsed:10.1f} sections/s  ({baseline / elapsed:.1f}x)  "
+              f"cosine vs torch mean={cosine.mean():.5f} min={cosine.min():.5f}  setup {setup:.1f}s")
+    return ok
+
+
+def synthetic_embeddings(rows, dim, clusters, seed=0):
+    """Unit vectors scattered around random topic directions."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    vectors = centers[rng.integers(clusters, size=rows)] + 1.8 * rng.standard_normal((rows, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def bench_ann(rows, n_queries, nprobes, k, dim=384):
+    from src.section_index import MIN_TRAIN_ROWS, SectionIndex
+
+    vectors = synthetic_embeddings(rows + n_queries, dim, clusters=max(1, rows // 500))
+    queries = vectors[rows:]
+    with tempfile.TemporaryDirectory() as tmp:
+        index = SectionIndex(tmp, dim=dim)
+        start = time.perf_counter()
+        batch = 10000
+        for i in range(0, rows, batch):
+            chunk = vectors[i:min(i + batch, rows)]
+            sections = [{"page": j, "title": str(i + j), "heading_level": "H1"} for j in range(len(chunk))]
+            index.add_document(f"doc-{i // batch}", sections, chunk)
+        clusters = "exact search" if index.centroids is None else f"{len(index.centroids)} clusters"
+        print(f"{rows} rows x {dim}, {clusters}, built in {time.perf_counter() - start:.1f}s")
+
+        def hits(results):
+            return [{(r["document"], r["page"]) for r in res} for res in results]
+
+        start = time.perf_counter()
+        truth = hits(index.search_exact(queries, k))
+        batched = (time.perf_counter() - start) / n_queries
+        start = time.perf_counter()
+        for q in queries[:20]:
+            index.search_exact(q, k)
+        exact = (time.perf_counter() - start) / len(queries[:20])
+        print(f"  exact, batched   {batched * 1000:8.2f} ms/query")
+        print(f"  exact, 1 query   {exact * 1000:8.2f} ms/query")
+        if index.centroids is None:
+            print(f"  index not trained below {MIN_TRAIN_ROWS} rows; search() is exact and nprobe has no effect")
+            return
+        for nprobe in nprobes:
+            start = time.perf_counter()
+            found = hits(index.search(queries, k, nprobe=nprobe))
+            elapsed = (time.perf_counter() - start) / n_queries
+            recall = np.mean([len(f & t) / len(t) for f, t in zip(found, truth)])
+            print(f"  nprobe={nprobe:<4d}     {elapsed * 1000:8.2f} ms/query  recall@{k}={recall:.3f}  ({exact / elapsed:.1f}x)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    embed = sub.add_parser("embed", help="embedding throughput, batched vs one-by-one")
+    embed.add_argument("--batch-sizes", default="1,8,32,64")
+    embed.add_argument("--repeat", type=int, default=3)
+    backends = sub.add_parser("backends", help="embedding backends: throughput and parity with torch")
+    backends.add_argument("--backends", default="torch,int8,onnx")
+    backends.add_argument("--batch-size", type=int, default=32)
+    backends.add_argument("--repeat", type=int, default=3)
+    backends.add_argument("--min-cosine", type=float, default=0.99)
+    ann = sub.add_parser("ann", help="IVF section index latency and recall vs exact search")
+    ann.add_argument("--rows", type=int, default=200000)
+    ann.add_argument("--queries", type=int, default=200)
+    ann.add_argument("--nprobe", default="1,4,8,16,32")
+    ann.add_argument("--top-k", type=int, default=10)
+    args = parser.parse_args()
+
+    if args.command == "embed":
+        bench_embed(load_section_texts(), [int(b) for b in args.batch_sizes.split(",")], args.repeat)
+    elif args.command == "backends":
+        names = args.backends.split(",")
+        if not bench_backends(load_section_texts(), names, args.batch_size, args.repeat, args.min_cosine):
+            sys.exit(1)
+    elif args.command == "ann":
+        bench_ann(args.rows, args.queries, [int(n) for n in args.nprobe.split(",")], args.top_k)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""Maintain and query a persistent section index across many runs.
+
+    python index.py add [PDF ...]          # default: every PDF in input/
+    python index.py remove NAME [NAME ...]
+    python index.py query --persona "..." --job "..." [--top-k 5] [--nprobe 8]
+    python index.py stats
+    python index.py compact
+
+Documents are keyed by file name and versioned by content hash, so "add" only
+re-embeds PDFs that are new or changed. See src/section_index.py for the
+on-disk layout.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+
+from src import ranker
+from src.parser import iter_text_sections
+from src.section_index import DEFAULT_NPROBE, INDEX_DIR, SectionIndex
+
+INPUT_DIR = os.path.join(os.getcwd(), "input")
+
+
+def file_version(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def open_index(index_dir):
+    """Open the index; a new one takes its dimension from the embedding model."""
+    if os.path.exists(os.path.join(index_dir, "log.jsonl")):
+        return SectionIndex(index_dir)
+    _, model = ranker.get_model()
+    return SectionIndex(index_dir, dim=model.config.hidden_size)
+
+
+def add_documents(index, paths):
+    # The index keeps the vectors itself; going through the embedding store
+    # would rewrite its whole key map once per document.
+    added = 0
+    for path in paths:
+        name = os.path.basename(path)
+        version = file_version(path)
+        if index.has_document(name, version):
+            continue
+        sections = list(iter_text_sections(path))
+        vectors = ranker.embed_sections(sections) if sections else []
+        index.add_document(name, sections, vectors, version=version)
+        print(f"Indexed {name}: {len(sections)} sections")
+        added += 1
+    return added
+
+
+def query_index(index, persona, job, top_k=5, nprobe=DEFAULT_NPROBE):
+    query = ranker.embed_texts([f"{persona}. {job}"]).numpy()
+    return index.search(query, k=top_k, nprobe=nprobe)[0]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--index-dir", default=INDEX_DIR)
+    sub = parser.add_subparsers(dest="command", required=True)
+    add = sub.add_parser("add", help="index new or changed PDFs")
+    add.add_argument("pdfs", nargs="*")
+    remove = sub.add_parser("remove", help="drop documents from the index")
+    remove.add_argument("names", nargs="+")
+    query = sub.add_parser("query", help="top sections for a persona and job")
+    query.add_argument("--persona", required=True)
+    query.add_argument("--job", required=True)
+    query.add_argument("--top-k", type=int, default=5)
+    query.add_argument("--nprobe", type=int, default=DEFAULT_NPROBE, help="clusters scanned per query")
+    sub.add_parser("stats", help="document and section counts")
+    sub.add_parser("compact", help="rewrite the index without deleted sections")
+    args = parser.parse_args(argv)
+
+    index = open_index(args.index_dir)
+    if args.command == "add":
+        paths = args.pdfs or sorted(
+            os.path.join(INPUT_DIR, f) for f in os.listdir(INPUT_DIR) if f.endswith(".pdf")
+        )
+        print(f"{add_documents(index, paths)} documents added")
+    elif args.command == "remove":
+        for name in args.names:
+            if not index.remove_document(name):
+                print(f"Not in index: {name}", file=sys.stderr)
+    elif args.command == "query":
+        results = query_index(index, args.persona, args.job, args.top_k, args.nprobe)
+        print(json.dumps(results, indent=2, ensure_ascii=False))
+    elif args.command == "stats":
+        print(json.dumps({
+            "documents": len(index.documents),
+            "sections": len(index),
+            "rows_on_disk": index.n_rows,
+            "clusters": 0 if index.centroids is None else len(index.centroids),
+        }, indent=2))
+    elif args.command == "compact":
+        index.compact()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,48 +1,104 @@
-from src.parser import extract_text_sections
-from src.ranker import rank_sections
-from src.summarizer import summarize
+import time
+
+_START = time.perf_counter()
+
+from src.parser import iter_text_sections
+from src import ranker, summarizer
+from src.backends import BACKENDS
+from src.ranker import CANDIDATES, PREFILTER_MIN_SECTIONS, rank_sections
+from src.summarizer import summarize_many
 
 import os
+import sys
 import json
+import argparse
 from datetime import datetime
 
 INPUT_DIR = os.path.join(os.getcwd(), "input")
 OUTPUT_DIR = os.path.join(os.getcwd(), "output")
+CACHE_DIR = os.path.join(os.getcwd(), "cache")
+TASK_FILE = "persona_task.json"
 
+IMPORT_TIME = time.perf_counter() - _START
 
-# Load persona and job dynamically from JSON file
-with open("persona_task.json", "r") as f:
-    task_info = json.load(f)
-    persona = task_info["persona"]
-    job = task_info["job_to_be_done"]
 
-def main():
-    files = [f for f in os.listdir(INPUT_DIR) if f.endswith(".pdf")]
-    all_sections = []
+def load_task(path=TASK_FILE):
+    # Load persona and job dynamically from JSON file
+    with open(path, "r") as f:
+        task_info = json.load(f)
+    return task_info["persona"], task_info["job_to_be_done"]
+
 
-    for file in files:
-        full_path = os.path.join(INPUT_DIR, file)
-        print(f"Processing {file}...")
-        sections = extract_text_sections(full_path)
-        for section in sections:
-            section["document"] = file
-        all_sections.extend(sections)
+def print_timings(timings, summary_stats=()):
+    """Startup/run breakdown; model load times come from the lazy loaders."""
+    loads = {**ranker.load_times, **summarizer.load_times}
+    print("\nTimings:")
+    print(f"  {'imports':<20s} {IMPORT_TIME:8.3f}s")
+    for name, seconds in timings.items():
+        print(f"  {name:<20s} {seconds:8.3f}s")
+    for name, seconds in loads.items():
+        print(f"    {name:<18s} {seconds:8.3f}s")
+    for n, batch in enumerate(summary_stats):
+        print(f"    summary batch {n:<4d} {batch['seconds']:8.3f}s  ({batch['size']} texts, <= {batch['max_words']} words)")
 
-    top_sections = rank_sections(all_sections, persona, job)
 
+def analyze_documents(documents, persona, job, top_k=5, no_summary=False, summary_batch_size=8,
+                      summary_stats=None, timings=None, cache_dir=CACHE_DIR, verbose=True, candidates=CANDIDATES,
+                      pretokenize=False, prefilter_min=PREFILTER_MIN_SECTIONS):
+    """Parse, rank and summarize ``documents`` ((name, path, pdf_bytes or None) tuples).
+
+    With ``pretokenize``, each document's sections are tokenized on a
+    background thread while the next one is parsed, until the corpus is large
+    enough for the BM25 prefilter; from then on the prefilter picks what gets
+    embedded, and only those are tokenized.
+    """
+    timings = {} if timings is None else timings
+    token_stats = ranker.token_cache.snapshot()
+    pretokenizer = ranker.Pretokenizer(cache_dir=cache_dir) if pretokenize else None
+    start = time.perf_counter()
+    all_sections = []
+    for name, path, stream in documents:
+        if verbose:
+            print(f"Processing {name}...")
+        first = len(all_sections)
+        for section in iter_text_sections(path, stream=stream):
+            section["document"] = name
+            all_sections.append(section)
+        if pretokenizer and not ranker.prefilter_applies(len(all_sections), candidates, prefilter_min):
+            pretokenizer.submit(s["text"] for s in all_sections[first:])
+    timings["parse"] = time.perf_counter() - start
+    if pretokenizer:
+        start = time.perf_counter()
+        pretokenizer.close()
+        timings["pretokenize_wait"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    top_sections = rank_sections(
+        all_sections, persona, job, top_k=top_k, cache_dir=cache_dir, candidates=candidates, prefilter_min=prefilter_min
+    )
+    timings["rank"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if no_summary:
+        summaries = [{"refined_text": s["text"]} for s in top_sections]
+    else:
+        summaries = summarize_many(
+            [s["text"] for s in top_sections], batch_size=summary_batch_size, stats=summary_stats
+        )
     subsection_analysis = []
-    for s in top_sections:
-        summary = summarize(s["text"])
+    for s, summary in zip(top_sections, summaries):
         summary["document"] = s["document"]
         summary["page_number"] = s["page"]
         subsection_analysis.append(summary)
+    timings["summarize"] = time.perf_counter() - start
 
-    output = {
+    return {
         "metadata": {
-            "documents": files,
+            "documents": [name for name, _, _ in documents],
             "persona": persona,
             "job_to_be_done": job,
-            "timestamp": datetime.now().isoformat()
+            "timestamp": datetime.now().isoformat(),
+            "tokenization": ranker.token_cache.report(token_stats)
         },
         "extracted_sections": [{
             "document": s["document"],
@@ -53,11 +109,57 @@ def main():
         "subsection_analysis": subsection_analysis
     }
 
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rank and summarize PDF sections for a persona.")
+    parser.add_argument("--no-summary", action="store_true", help="skip the summarization model")
+    parser.add_argument("--top-k", type=int, default=5, help="number of sections to return")
+    parser.add_argument("--summary-batch-size", type=int, default=8, help="texts per summarization batch")
+    parser.add_argument("--candidates", type=int, default=CANDIDATES,
+                        help="sections kept by the BM25 prefilter before embedding (0 embeds all)")
+    parser.add_argument("--prefilter-min", type=int, default=PREFILTER_MIN_SECTIONS,
+                        help="only prefilter collections with more sections than this")
+    parser.add_argument("--backend", choices=BACKENDS, default=ranker.BACKEND, help="embedding inference runtime")
+    parser.add_argument("--pooling", choices=ranker.POOLINGS, default=ranker.POOLING,
+                        help="how windows of sections longer than the model limit are combined")
+    parser.add_argument("--pretokenize", action="store_true",
+                        help="tokenize sections not in the embedding cache while parsing")
+    parser.add_argument("--timings", action="store_true", help="print a startup/run time breakdown")
+    args = parser.parse_args(argv)
+    ranker.use_backend(args.backend)
+    ranker.use_pooling(args.pooling)
+
+    files = [f for f in os.listdir(INPUT_DIR) if f.endswith(".pdf")] if os.path.isdir(INPUT_DIR) else []
+    if not files:
+        print(f"No PDFs found in {INPUT_DIR}")
+        return 1
+    persona, job = load_task()
+
+    timings = {}
+    summary_stats = []
+    output = analyze_documents(
+        [(file, os.path.join(INPUT_DIR, file), None) for file in files],
+        persona,
+        job,
+        top_k=args.top_k,
+        no_summary=args.no_summary,
+        summary_batch_size=args.summary_batch_size,
+        summary_stats=summary_stats,
+        timings=timings,
+        candidates=args.candidates,
+        prefilter_min=args.prefilter_min,
+        pretokenize=args.pretokenize,
+    )
+
     os.makedirs(OUTPUT_DIR, exist_ok=True)
     output_path = os.path.join(OUTPUT_DIR, "output.json")
     with open(output_path, "w") as f:
         json.dump(output, f, indent=2)
     print(f"\n✅ Output written to {output_path}")
 
+    if args.timings:
+        print_timings(timings, summary_stats)
+    return 0
+
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,212 @@
+"""Long-running ranking service with warm models.
+
+    python service.py --port 8081
+    python service.py --socket /tmp/rank.sock
+
+    POST /rank    JSON {"persona": ..., "job_to_be_done": ...,
+                        "paths": ["input/a.pdf", ...]            # files on this host
+                        or "documents": [{"name": ..., "data": <base64 PDF>}],
+                        "top_k": 5, "summarize": true, "candidates": 500,
+                        "prefilter_min": 20000}
+    GET  /health
+
+The MiniLM and distilbart models are loaded once at startup. At most
+--concurrency requests run at a time (the models already use every core),
+--max-queue more may wait, and the rest get 503 with Retry-After.
+"""
+import argparse
+import base64
+import binascii
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from run import analyze_documents
+from src import ranker, summarizer
+from src.backends import BACKENDS
+
+MAX_BODY_BYTES = 200 * 1024 * 1024
+
+
+class Admission:
+    """Bounded concurrency plus a bounded wait queue."""
+
+    def __init__(self, concurrency, max_queue):
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self._slots = threading.Semaphore(concurrency)
+        self._lock = threading.Lock()
+        self.waiting = 0
+        self.running = 0
+
+    def try_enter(self):
+        with self._lock:
+            if self.waiting >= self.max_queue and self.running >= self.concurrency:
+                return False
+            self.waiting += 1
+        self._slots.acquire()
+        with self._lock:
+            self.waiting -= 1
+            self.running += 1
+        return True
+
+    def leave(self):
+        with self._lock:
+            self.running -= 1
+        self._slots.release()
+
+
+def parse_documents(payload):
+    documents = []
+    for path in payload.get("paths", []):
+        if not os.path.isfile(path):
+            raise ValueError(f"file not found: {path}")
+        documents.append((os.path.basename(path), path, None))
+    for i, doc in enumerate(payload.get("documents", [])):
+        name = doc.get("name") or f"upload-{i}.pdf"
+        try:
+            data = base64.b64decode(doc["data"], validate=True)
+        except (KeyError, binascii.Error):
+            raise ValueError(f"document {name!r} needs base64 'data'")
+        documents.append((name, name, data))
+    if not documents:
+        raise ValueError("no documents given")
+    return documents
+
+
+class RankHandler(BaseHTTPRequestHandler):
+    server_version = "RankService/1.0"
+
+    def address_string(self):
+        # Unix-socket peers have no address tuple
+        return self.client_address[0] if self.client_address else "unix"
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != "/health":
+            self._send_json(404, {"error": "not found"})
+            return
+        gate = self.server.admission
+        self._send_json(200, {"status": "ok", "running": gate.running, "queued": gate.waiting})
+
+    def do_POST(self):
+        if self.path != "/rank":
+            self._send_json(404, {"error": "not found"})
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        if length <= 0 or length > MAX_BODY_BYTES:
+            self._send_json(400 if length <= 0 else 413, {"error": "missing or oversized body"})
+            return
+        gate = self.server.admission
+        # Admit before reading the body, so waiting requests do not hold it.
+        if not gate.try_enter():
+            self._send_json(503, {"error": "server busy"}, {"Retry-After": "1"})
+            return
+        try:
+            self._rank(length)
+        finally:
+            gate.leave()
+
+    def _rank(self, length):
+        try:
+            payload = json.loads(self.rfile.read(length))
+            persona, job = payload["persona"], payload["job_to_be_done"]
+            documents = parse_documents(payload)
+        except KeyError as e:
+            self._send_json(400, {"error": f"missing field {e}"})
+            return
+        except ValueError as e:
+            self._send_json(400, {"error": str(e)})
+            return
+
+        try:
+            start = time.perf_counter()
+            output = analyze_documents(
+                documents,
+                persona,
+                job,
+                top_k=int(payload.get("top_k", 5)),
+                no_summary=not payload.get("summarize", True),
+                cache_dir=self.server.cache_dir,
+                verbose=False,
+                candidates=int(payload.get("candidates", ranker.CANDIDATES)),
+                prefilter_min=int(payload.get("prefilter_min", ranker.PREFILTER_MIN_SECTIONS)),
+            )
+            elapsed = time.perf_counter() - start
+        except Exception as e:
+            self._send_json(500, {"error": f"{type(e).__name__}: {e}"})
+            return
+        self._send_json(200, output, {"X-Processing-Seconds": f"{elapsed:.4f}"})
+
+class RankHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, admission, cache_dir):
+        self.admission = admission
+        self.cache_dir = cache_dir
+        super().__init__(address, RankHandler)
+
+
+class RankUnixServer(RankHTTPServer):
+    address_family = socket.AF_UNIX
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+        socketserver.TCPServer.server_bind(self)
+        self.server_name = "localhost"
+        self.server_port = 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve persona-based section ranking over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--socket", default=None, help="listen on a Unix socket instead of TCP")
+    parser.add_argument("--concurrency", type=int, default=1, help="requests processed at once")
+    parser.add_argument("--max-queue", type=int, default=16, help="requests allowed to wait")
+    parser.add_argument("--cache-dir", default=os.path.join(os.getcwd(), "cache"), help="embedding cache directory")
+    parser.add_argument("--backend", choices=BACKENDS, default=ranker.BACKEND, help="embedding inference runtime")
+    parser.add_argument("--pooling", choices=ranker.POOLINGS, default=ranker.POOLING,
+                        help="how windows of sections longer than the model limit are combined")
+    parser.add_argument("--no-summary-model", action="store_true", help="do not preload distilbart")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    ranker.use_backend(args.backend)
+    ranker.use_pooling(args.pooling)
+    ranker.warm_up()
+    if not args.no_summary_model:
+        summarizer.warm_up()
+    print(f"Models ready in {time.perf_counter() - start:.1f}s")
+
+    admission = Admission(args.concurrency, args.max_queue)
+    if args.socket:
+        server = RankUnixServer(args.socket, admission, args.cache_dir)
+        print(f"Listening on unix:{args.socket}")
+    else:
+        server = RankHTTPServer((args.host, args.port), admission, args.cache_dir)
+        print(f"Listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
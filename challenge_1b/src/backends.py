@@ -0,0 +1,112 @@
+"""CPU inference backends for the ranker's embedding model.
+
+    torch   full-precision PyTorch (default)
+    int8    PyTorch with every Linear layer dynamically quantized to int8
+    onnx    ONNX Runtime, on a graph exported once and cached under cache/onnx/
+
+A backend maps padded ``input_ids`` and ``attention_mask`` tensors to the
+model's last hidden states as a float32 torch tensor; tokenization and
+pooling stay in ranker. torch and onnxruntime are imported on first use.
+"""
+import hashlib
+import os
+
+BACKENDS = ("torch", "int8", "onnx")
+ONNX_DIR = os.path.join(os.getcwd(), "cache", "onnx")
+ONNX_OPSET = 17
+
+
+class TorchBackend:
+    name = "torch"
+
+    def __init__(self, model):
+        self.model = model
+
+    def __call__(self, input_ids, attention_mask):
+        return self.model(input_ids=input_ids, attention_mask=attention_mask).last_hidden_state
+
+
+class Int8Backend(TorchBackend):
+    name = "int8"
+
+    def __init__(self, model):
+        import torch
+        from torch.ao.quantization import quantize_dynamic
+
+        # Weights become int8 ahead of time; activations are quantized per
+        # batch, so there is no calibration step.
+        super().__init__(quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8))
+
+
+def onnx_path(model, model_name, export_dir=ONNX_DIR):
+    """Export location; a different model config or opset gets a new file."""
+    config = hashlib.sha1(model.config.to_json_string(use_diff=False).encode("utf-8")).hexdigest()[:12]
+    return os.path.join(export_dir, f"{model_name.replace('/', '__')}-{config}.opset{ONNX_OPSET}.onnx")
+
+
+def export_onnx(model, path):
+    """Export ``model`` to ``path``; the file appears only once it is complete."""
+    import torch
+
+    class HiddenStates(torch.nn.Module):
+        """The model behind a plain (input_ids, attention_mask) signature."""
+
+        def __init__(self):
+            super().__init__()
+            self.model = model
+
+        def forward(self, input_ids, attention_mask):
+            return self.model(input_ids=input_ids, attention_mask=attention_mask).last_hidden_state
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    dummy = torch.ones(1, 8, dtype=torch.long)
+    axes = {0: "batch", 1: "tokens"}
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with torch.no_grad():
+        torch.onnx.export(
+            HiddenStates().eval(),
+            (dummy, dummy),
+            tmp,
+            input_names=["input_ids", "attention_mask"],
+            output_names=["last_hidden_state"],
+            dynamic_axes={"input_ids": axes, "attention_mask": axes, "last_hidden_state": axes},
+            opset_version=ONNX_OPSET,
+            dynamo=False,
+        )
+    os.replace(tmp, path)
+
+
+class OnnxBackend:
+    name = "onnx"
+
+    def __init__(self, model, model_name, export_dir=ONNX_DIR):
+        import onnxruntime
+        import torch
+
+        path = onnx_path(model, model_name, export_dir)
+        if not os.path.exists(path):
+            export_onnx(model, path)
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = torch.get_num_threads()
+        self.session = onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.path = path
+
+    def __call__(self, input_ids, attention_mask):
+        import torch
+
+        (hidden,) = self.session.run(
+            ["last_hidden_state"],
+            {"input_ids": input_ids.numpy(), "attention_mask": attention_mask.numpy()},
+        )
+        return torch.from_numpy(hidden)
+
+
+def create_backend(name, model, model_name):
+    if name == "torch":
+        return TorchBackend(model)
+    if name == "int8":
+        return Int8Backend(model)
+    if name == "onnx":
+        return OnnxBackend(model, model_name)
+    raise ValueError(f"unknown embedding backend {name!r}; expected one of {', '.join(BACKENDS)}")
@@ -0,0 +1,102 @@
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+
+CACHE_DIR = os.path.join(os.getcwd(), "cache")
+
+
+def text_key(text):
+    """Content hash of a section, insensitive to whitespace differences."""
+    normalized = " ".join(text.split())
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+
+class EmbeddingStore:
+    """Append-only on-disk embedding cache for one model.
+
+    Vectors live in ``<model>.f32`` as a raw float32 matrix that is read through
+    a memory map; ``<model>.index.json`` maps text keys to row numbers. The index
+    is replaced atomically after the rows are appended, so a crash can at worst
+    leave unreferenced rows at the end of the matrix. One instance per file is
+    safe to share between threads; two instances on the same files are not.
+    """
+
+    def __init__(self, model_name, dim, cache_dir=CACHE_DIR):
+        self.model_name = model_name
+        self.dim = dim
+        slug = model_name.replace("/", "__")
+        self.matrix_path = os.path.join(cache_dir, f"{slug}.f32")
+        self.index_path = os.path.join(cache_dir, f"{slug}.index.json")
+        self._lock = threading.Lock()
+        self._rows = {}
+        self._matrix = None
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r") as f:
+                index = json.load(f)
+            if index.get("model") == self.model_name and index.get("dim") == self.dim:
+                self._rows = index["rows"]
+        self._matrix = self._map(len(self._rows))
+
+    def _map(self, n):
+        if n == 0 or not os.path.exists(self.matrix_path):
+            return np.empty((0, self.dim), dtype=np.float32)
+        return np.memmap(self.matrix_path, dtype=np.float32, mode="r", shape=(n, self.dim))
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, key):
+        return key in self._rows
+
+    def get_many(self, keys):
+        """Return (vectors, missing) where missing lists positions not in the store.
+
+        Rows for missing keys are left as zeros in ``vectors``.
+        """
+        out = np.zeros((len(keys), self.dim), dtype=np.float32)
+        hit_pos, hit_rows, missing = [], [], []
+        with self._lock:
+            rows, matrix = self._rows, self._matrix
+        for pos, key in enumerate(keys):
+            row = rows.get(key)
+            if row is None:
+                missing.append(pos)
+            else:
+                hit_pos.append(pos)
+                hit_rows.append(row)
+        if hit_pos:
+            out[hit_pos] = matrix[hit_rows]
+        return out, missing
+
+    def put_many(self, keys, vectors):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        with self._lock:
+            new = {}
+            for key, vec in zip(keys, vectors):
+                if key not in self._rows and key not in new:
+                    new[key] = vec
+            if not new:
+                return
+            # Drop rows past the index (left over from an interrupted write).
+            expected = len(self._rows) * self.dim * 4
+            with open(self.matrix_path, "ab") as f:
+                if f.tell() != expected:
+                    f.truncate(expected)
+                    f.seek(expected)
+                f.write(np.stack(list(new.values())).tobytes())
+            start = len(self._rows)
+            rows = dict(self._rows)
+            rows.update({key: start + i for i, key in enumerate(new)})
+            tmp = self.index_path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump({"model": self.model_name, "dim": self.dim, "rows": rows}, f)
+            os.replace(tmp, self.index_path)
+            # Readers take both under the lock, so they never see rows past the map.
+            self._rows, self._matrix = rows, self._map(len(rows))
@@ -0,0 +1,89 @@
+"""BM25 over section titles and bodies, used to prefilter before embedding.
+
+The index is a plain inverted index: every term maps to a slice of
+``postings`` (section row, term frequency), so scoring a query touches only
+the sections that share a term with it.
+"""
+import re
+from collections import Counter
+
+import numpy as np
+
+TOKEN_RE = re.compile(r"[^\W_]+")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were will with "
+    "you your i we our they their".split()
+)
+# Titles are short but say what the section is about; count their terms twice.
+TITLE_WEIGHT = 2
+
+
+def _term(token):
+    """Index term for a lower-cased token, or None for a stopword."""
+    if token in STOPWORDS:
+        return None
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+def tokenize(text):
+    """Lower-cased word tokens without stopwords; a trailing plural "s" is dropped."""
+    return [t for t in map(_term, TOKEN_RE.findall(text.lower())) if t is not None]
+
+
+class BM25Index:
+    def __init__(self, sections, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.vocab = {}
+        term_ids = {}  # raw token -> term id, -1 for stopwords
+        chunks = []
+        for section in sections:
+            tokens = TOKEN_RE.findall(section.get("text", "").lower())
+            tokens.extend(TOKEN_RE.findall((section.get("title") or "").lower()) * TITLE_WEIGHT)
+            ids = list(map(term_ids.get, tokens))
+            if None in ids:
+                for i, tid in enumerate(ids):
+                    if tid is None:
+                        token = tokens[i]
+                        tid = term_ids.get(token)
+                        if tid is None:
+                            term = _term(token)
+                            tid = term_ids[token] = -1 if term is None else self.vocab.setdefault(term, len(self.vocab))
+                        ids[i] = tid
+            chunks.append(np.array(ids, dtype=np.int64))
+
+        n = len(sections)
+        token_rows = np.repeat(np.arange(n, dtype=np.int64), [len(c) for c in chunks])
+        token_terms = np.concatenate(chunks) if chunks else np.empty(0, dtype=np.int64)
+        kept = token_terms >= 0
+        token_rows, token_terms = token_rows[kept], token_terms[kept]
+        lengths = np.bincount(token_rows, minlength=n).astype(np.float32)
+        # One posting per (term, section), grouped by term.
+        keys, tfs = np.unique(token_terms * max(n, 1) + token_rows, return_counts=True)
+        terms = keys // max(n, 1)
+        self.rows = (keys % max(n, 1)).astype(np.int32)
+        self.tfs = tfs.astype(np.float32)
+        df = np.bincount(terms, minlength=len(self.vocab))
+        self.offsets = np.concatenate(([0], np.cumsum(df))).astype(np.int64)
+
+        self.idf = np.log1p((n - df + 0.5) / (df + 0.5)).astype(np.float32)
+        avg = lengths.mean() if n else 0.0
+        # Per-section part of the BM25 denominator, precomputed once.
+        self.norm = (k1 * (1 - b + b * lengths / max(avg, 1e-9))).astype(np.float32)
+
+    def __len__(self):
+        return len(self.norm)
+
+    def scores(self, query):
+        """BM25 score of every section for ``query`` (text)."""
+        out = np.zeros(len(self), dtype=np.float32)
+        for term, qtf in Counter(tokenize(query)).items():
+            tid = self.vocab.get(term)
+            if tid is None:
+                continue
+            lo, hi = self.offsets[tid], self.offsets[tid + 1]
+            rows, tfs = self.rows[lo:hi], self.tfs[lo:hi]
+            out[rows] += qtf * self.idf[tid] * tfs * (self.k1 + 1) / (tfs + self.norm[rows])
+        return out
@@ -1,45 +1,125 @@
 import fitz  # PyMuPDF
+import numpy as np
 
-def extract_text_sections(pdf_path):
-    doc = fitz.open(pdf_path)
-    sections = []
-    
-    title = doc.metadata.get("title") or "Untitled Document"
-    font_stats = {}
+from src.spantable import FontTable, SpanTable
+
+# Every section gets at least this many following lines, even when the next
+# heading comes sooner.
+CONTEXT_LINES = 5
+
+# Section bodies are cut at this many characters; the ranker and summarizer
+# only look at the first few hundred tokens anyway.
+MAX_SECTION_CHARS = 20000
 
+# Documents up to this many pages are decoded once and held in memory; longer
+# ones are decoded twice (statistics pass, then classification pass) so that
+# memory stays flat however many pages there are.
+IN_MEMORY_PAGES = 200
+
+def iter_lines(doc, font_stats=None):
+    """Yield (page_num, text, size) lines page by page, counting rounded span
+    sizes into ``font_stats`` if given. Each page is flattened into a span
+    table and released before the next one is decoded; a line's size is that
+    of its last span."""
+    fonts = FontTable()
     for page_num in range(len(doc)):
-        page = doc.load_page(page_num)
-        blocks = page.get_text("dict")["blocks"]
-
-        for block in blocks:
-            if "lines" not in block:
-                continue
-            for line in block["lines"]:
-                line_text = ""
-                for span in line["spans"]:
-                    line_text += span["text"].strip() + " "
-                    font_size = round(span["size"])
-                    font_stats[font_size] = font_stats.get(font_size, 0) + 1
-
-                line_text = line_text.strip()
-                if len(line_text.split()) < 2:
-                    continue  # likely not a real heading
-
-                heading_level = classify_heading_level(span["size"], font_stats)
-                if heading_level:
-                    sections.append({
-                        "title": line_text,
-                        "text": extract_context(doc, page_num, line_text),
-                        "page": page_num + 1,
-                        "heading_level": heading_level
-                    })
-    return sections
+        table = SpanTable.from_page(doc.load_page(page_num).get_text("dict"), page_num, fonts)
+        if font_stats is not None and len(table):
+            # np.round and round() both round half to even
+            sizes, counts = np.unique(np.round(table.size).astype(np.int64), return_counts=True)
+            for font_size, count in zip(sizes.tolist(), counts.tolist()):
+                font_stats[font_size] = font_stats.get(font_size, 0) + count
+
+        for line_text, size in zip(table.line_texts(), table.line_last(table.size).tolist()):
+            if line_text:
+                yield page_num, line_text, size
+
+def read_lines(doc):
+    """Phase one: decode every page once into (page_num, text, size) lines and
+    count rounded span sizes over the whole document."""
+    font_stats = {}
+    lines = list(iter_lines(doc, font_stats))
+    return lines, font_stats
+
+def _scan_stats(doc):
+    """Statistics pass for long documents: font counts and line sizes only."""
+    font_stats = {}
+    sizes = {size for _, _, size in iter_lines(doc, font_stats)}
+    return font_stats, sizes
+
+def iter_text_sections(pdf_path, context_lines=CONTEXT_LINES, stream=None, max_section_chars=MAX_SECTION_CHARS):
+    """Yield sections as soon as they are complete.
+
+    A section is complete once a later heading has started and it has received
+    its ``context_lines``, so only a handful of sections are open at a time.
+    """
+    # stream: PDF bytes already in memory (pdf_path is then just a label)
+    doc = fitz.open(stream=stream, filetype="pdf") if stream is not None else fitz.open(pdf_path)
+    try:
+        title = doc.metadata.get("title") or "Untitled Document"
+        if len(doc) <= IN_MEMORY_PAGES:
+            lines, font_stats = read_lines(doc)
+            sizes = {size for _, _, size in lines}
+        else:
+            font_stats, sizes = _scan_stats(doc)
+            lines = iter_lines(doc)
+
+        # Phase two: classify against statistics frozen over the whole document
+        level_table = build_level_table(font_stats, sizes)
+        pending = []  # [section, body lines, body chars, lines still owed], oldest first
+
+        for page_num, line_text, size in lines:
+            for entry in pending:
+                if entry[3] > 0:
+                    _append_body(entry, line_text, max_section_chars)
+                    entry[3] -= 1
+
+            heading_level = None
+            if len(line_text.split()) >= 2:  # single words are likely not real headings
+                heading_level = level_table[size]
+            if heading_level:
+                pending.append([{
+                    "title": line_text,
+                    "text": "",
+                    "page": page_num + 1,
+                    "heading_level": heading_level
+                }, [], 0, context_lines])
+            elif pending and pending[-1][3] <= 0:
+                # A section runs from its heading to the next one
+                _append_body(pending[-1], line_text, max_section_chars)
+
+            while len(pending) > 1 and pending[0][3] <= 0:
+                yield _finish(pending.pop(0), max_section_chars)
+
+        for entry in pending:
+            yield _finish(entry, max_section_chars)
+    finally:
+        doc.close()
+
+def _append_body(entry, line_text, max_chars):
+    if entry[2] < max_chars:
+        entry[1].append(line_text)
+        entry[2] += len(line_text) + 1
+
+def _finish(entry, max_chars):
+    section, body = entry[0], entry[1]
+    section["text"] = " ".join(body)[:max_chars]
+    return section
+
+def extract_text_sections(pdf_path, context_lines=CONTEXT_LINES, stream=None):
+    return list(iter_text_sections(pdf_path, context_lines, stream))
+
+def build_level_table(font_stats, sizes):
+    """Map every span size that occurs to its heading level (or None)."""
+    return {size: classify_heading_level(size, font_stats) for size in sizes}
 
 def classify_heading_level(font_size, font_stats):
     # Dynamically define size thresholds
     if not font_stats:
         return None
-    sorted_sizes = sorted(font_stats.items(), key=lambda x: -x[1])
+    # Most frequent size first; ties go to the larger size so the result does
+    # not depend on the order pages were read in
+    sorted_sizes = sorted(font_stats.items(), key=lambda x: (-x[1], -x[0]))
     if len(sorted_sizes) < 2:
         return "H1"
     max_size = sorted_sizes[0][0]
@@ -51,16 +131,3 @@ def classify_heading_level(font_size, font_stats):
         return "H3"
     else:
         return None
-
-def extract_context(doc, page_num, heading_text, context_lines=5):
-    """Get some text below the heading to represent its content"""
-    page = doc.load_page(page_num)
-    full_text = page.get_text()
-    lines = full_text.split('\n')
-
-    for idx, line in enumerate(lines):
-        if heading_text.strip().lower() in line.strip().lower():
-            start = idx + 1
-            end = min(start + context_lines, len(lines))
-            return " ".join(lines[start:end]).strip()
-    return ""
@@ -1,29 +1,383 @@
-from sklearn.metrics.pairwise import cosine_similarity
-from transformers import AutoTokenizer, AutoModel
-import torch
+import queue
+import threading
+import time
+
+import numpy as np
+
+from src.backends import BACKENDS, create_backend
+from src.embedding_store import EmbeddingStore, text_key
+from src.lexical import BM25Index
+from src.token_cache import TokenCache
 
 # Load a small model to stay within 1GB
 MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+MAX_LENGTH = 512
+BATCH_SIZE = 32
+# Sections kept per query by the BM25 prefilter before anything is embedded;
+# 0 embeds every section.
+CANDIDATES = 500
+# The prefilter trades exhaustive ranking for speed, so it only runs on
+# collections of more than this many sections; smaller ones are cheap enough
+# to embed in full.
+PREFILTER_MIN_SECTIONS = 20000
+# Reciprocal rank fusion constant: higher flattens the gap between ranks.
+RRF_K = 60
+# Long texts are cut into windows of MAX_LENGTH tokens overlapping by
+# CHUNK_OVERLAP, at most MAX_CHUNKS per text, and the window vectors pooled:
+# "first" keeps only the first window (plain truncation), "mean" averages
+# them, "max" takes the element-wise maximum. Set with use_pooling.
+POOLINGS = ("first", "mean", "max")
+POOLING = "first"
+CHUNK_OVERLAP = 128
+MAX_CHUNKS = 8
+# Text is cut to this many characters per token of budget before it is
+# tokenized, so a huge section never costs more than its windows need.
+CHARS_PER_TOKEN = 16
 
-tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
-model = AutoModel.from_pretrained(MODEL_NAME)
+# torch/transformers and the model itself are loaded on first use, once per
+# process, so importing this module is cheap.
+_tokenizer = None
+_model = None
+_model_lock = threading.Lock()
+load_times = {}
+# Inference runtime for embeddings (see src/backends.py); set with use_backend.
+BACKEND = "torch"
+_backends = {}
+_backend_lock = threading.Lock()
+# Token ids of recently embedded texts, shared by every call in the process.
+token_cache = TokenCache()
+
+
+def get_model():
+    """Return the shared (tokenizer, model) pair, loading it on first call."""
+    global _tokenizer, _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                start = time.perf_counter()
+                from transformers import AutoTokenizer, AutoModel
+                load_times["ranker_import"] = time.perf_counter() - start
+
+                start = time.perf_counter()
+                tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
+                load_times["ranker_tokenizer"] = time.perf_counter() - start
+
+                start = time.perf_counter()
+                model = AutoModel.from_pretrained(MODEL_NAME)
+                model.eval()
+                load_times["ranker_model"] = time.perf_counter() - start
+                _tokenizer = tokenizer
+                _model = model
+    return _tokenizer, _model
+
+
+def use_backend(name):
+    """Embed with backend ``name`` ("torch", "int8" or "onnx") from now on."""
+    global BACKEND
+    if name not in BACKENDS:
+        raise ValueError(f"unknown embedding backend {name!r}; expected one of {', '.join(BACKENDS)}")
+    BACKEND = name
+
+
+def use_pooling(name):
+    """Pool window embeddings of long texts with ``name`` ("first", "mean" or "max") from now on."""
+    global POOLING
+    if name not in POOLINGS:
+        raise ValueError(f"unknown pooling {name!r}; expected one of {', '.join(POOLINGS)}")
+    POOLING = name
+
+
+def get_backend(name=None):
+    """Return the shared backend ``name`` (default: BACKEND), building it on first call."""
+    name = name or BACKEND
+    if name not in _backends:
+        _, model = get_model()
+        with _backend_lock:
+            if name not in _backends:
+                start = time.perf_counter()
+                backend = create_backend(name, model, MODEL_NAME)
+                if name != "torch":
+                    load_times[f"ranker_backend_{name}"] = time.perf_counter() - start
+                _backends[name] = backend
+    return _backends[name]
+
+
+def warm_up():
+    """Load the model and run one forward pass so the first real call is fast."""
+    embed_texts(["warm up"])
+
+
+def mean_pool(last_hidden_state, attention_mask):
+    """Average token vectors, ignoring padding positions."""
+    mask = attention_mask.unsqueeze(-1).to(last_hidden_state.dtype)
+    summed = (last_hidden_state * mask).sum(dim=1)
+    counts = mask.sum(dim=1).clamp(min=1e-9)
+    return summed / counts
+
+
+def chunk_windows(token_ids, window, overlap=CHUNK_OVERLAP, max_chunks=MAX_CHUNKS):
+    """Start offsets of overlapping ``window``-token slices covering ``token_ids``.
+
+    The last window is aligned to the end of the text; past ``max_chunks``
+    windows the rest of the text is dropped.
+    """
+    stride = max(1, window - overlap)
+    excess = max(0, len(token_ids) - window)
+    count = min(max_chunks, 1 + -(-excess // stride))
+    return [min(k * stride, excess) for k in range(count)]
+
+
+def _special_tokens(tokenizer):
+    """(prefix, suffix) ids the tokenizer wraps a single text in, e.g. [CLS] / [SEP]."""
+    marked = tokenizer("a")["input_ids"]
+    plain = tokenizer("a", add_special_tokens=False)["input_ids"]
+    for i in range(len(marked) - len(plain) + 1):
+        if marked[i:i + len(plain)] == plain:
+            return marked[:i], marked[i + len(plain):]
+    raise ValueError("cannot locate special tokens")
+
+
+def _window_plan(tokenizer, max_length, pooling):
+    """(prefix, suffix, window, max_chunks, char_limit) for embedding with ``pooling``."""
+    prefix, suffix = _special_tokens(tokenizer)
+    window = max_length - len(prefix) - len(suffix)
+    max_chunks = 1 if pooling == "first" else MAX_CHUNKS
+    budget = window + (max_chunks - 1) * (window - CHUNK_OVERLAP)
+    return prefix, suffix, window, max_chunks, budget * CHARS_PER_TOKEN
+
+
+def tokenize_texts(texts, max_length=MAX_LENGTH, pooling=None, background=False):
+    """Token ids (without special tokens) that embed_texts will use for ``texts``."""
+    tokenizer, _ = get_model()
+    limit = _window_plan(tokenizer, max_length, pooling or POOLING)[-1]
+    return token_cache.encode_many(tokenizer, [t[:limit] for t in texts], background=background)
+
+
+class Pretokenizer:
+    """Tokenize texts on a background thread while the caller keeps parsing.
+
+    The fast tokenizer releases the GIL, so this overlaps with PDF parsing;
+    embed_texts then finds the ids in ``token_cache``. Texts whose vectors are
+    already in the store under ``cache_dir`` are skipped, as they will not be
+    embedded, and once ``budget`` tokens (default: half of ``token_cache``)
+    have been produced the rest is left to embed_texts, so ids are not
+    evicted before they are used.
+    """
+
+    def __init__(self, max_length=MAX_LENGTH, pooling=None, cache_dir=None, budget=None):
+        self.max_length = max_length
+        self.pooling = pooling or POOLING
+        self.cache_dir = cache_dir
+        self.budget = token_cache.max_tokens // 2 if budget is None else budget
+        self.tokens = 0
+        self.error = None
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="pretokenize", daemon=True)
+        self._thread.start()
+
+    def submit(self, texts):
+        self._queue.put(list(texts))
+
+    def _run(self):
+        store = None
+        while True:
+            texts = self._queue.get()
+            if texts is None:
+                return
+            if self.error is not None or self.tokens >= self.budget:
+                continue
+            try:
+                if self.cache_dir:
+                    if store is None:
+                        store = get_store(self.cache_dir)
+                    texts = [t for t in texts if text_key(t) not in store]
+                ids = tokenize_texts(texts, self.max_length, self.pooling, background=True)
+                self.tokens += sum(len(i) for i in ids)
+            except Exception as e:  # embed_texts will hit (and raise) the same problem
+                self.error = e
+
+    def close(self):
+        """Wait until everything submitted is tokenized."""
+        self._queue.put(None)
+        self._thread.join()
+
+
+def embed_texts(texts, batch_size=BATCH_SIZE, max_length=MAX_LENGTH, backend=None, pooling=None):
+    """Embed many texts at once; returns a (len(texts), dim) tensor in input order.
+
+    Texts are tokenized once, sorted by token length and padded per batch, so a
+    batch of short sections is not padded out to the longest one in the corpus.
+    Texts longer than ``max_length`` tokens are split into windows that go
+    through the model in the same batches and are pooled per text (see
+    POOLING). Token ids come from ``token_cache``. ``backend`` and ``pooling``
+    override the process-wide settings for this call.
+    """
+    import torch
+
+    tokenizer, model = get_model()
+    encode = get_backend(backend)
+    pooling = pooling or POOLING
+    texts = list(texts)
+    if not texts:
+        return torch.empty(0, model.config.hidden_size)
+
+    prefix, suffix, window, max_chunks, limit = _window_plan(tokenizer, max_length, pooling)
+    bodies = token_cache.encode_many(tokenizer, [t[:limit] for t in texts])
+    encoded, owner = [], []
+    for i, body in enumerate(bodies):
+        for start in chunk_windows(body, window, max_chunks=max_chunks):
+            encoded.append(prefix + body[start:start + window].tolist() + suffix)
+            owner.append(i)
+    order = sorted(range(len(encoded)), key=lambda i: len(encoded[i]))
+    chunks = torch.empty(len(encoded), model.config.hidden_size)
 
-def get_embedding(text):
-    inputs = tokenizer(text, return_tensors='pt', truncation=True, max_length=512)
     with torch.no_grad():
-        output = model(**inputs)
-    embeddings = output.last_hidden_state.mean(dim=1)
-    return embeddings
-
-def rank_sections(sections, persona, job_to_be_done, top_k=5):
-    query = f"{persona}. {job_to_be_done}"
-    query_vec = get_embedding(query)
-
-    for section in sections:
-        section_vec = get_embedding(section["text"])
-        similarity = cosine_similarity(query_vec, section_vec)[0][0]
-        section["score"] = similarity
-
-    # Sort by similarity
-    ranked = sorted(sections, key=lambda x: x["score"], reverse=True)
-    return ranked[:top_k]
+        for start in range(0, len(order), batch_size):
+            idx = order[start:start + batch_size]
+            batch = tokenizer.pad({"input_ids": [encoded[i] for i in idx]}, return_tensors="pt")
+            hidden = encode(batch["input_ids"], batch["attention_mask"])
+            chunks[idx] = mean_pool(hidden, batch["attention_mask"])
+
+    if len(encoded) == len(texts):
+        return chunks
+    # Windows are grouped by text, every text has at least one.
+    counts = np.bincount(owner, minlength=len(texts))
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    if pooling == "max":
+        return torch.from_numpy(np.maximum.reduceat(chunks.numpy(), starts))
+    return torch.from_numpy(np.add.reduceat(chunks.numpy(), starts) / counts[:, None].astype(np.float32))
+
+
+def get_embedding(text):
+    return embed_texts([text])
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(cache_dir):
+    # Quantized and exported models give slightly different vectors, so each
+    # backend other than the reference one caches under its own name; so does
+    # each pooling of long texts.
+    key = (cache_dir, BACKEND, POOLING)
+    if key not in _stores:
+        _, model = get_model()
+        # Two instances on the same files would truncate each other's rows.
+        with _stores_lock:
+            if key not in _stores:
+                name = MODEL_NAME if BACKEND == "torch" else f"{MODEL_NAME}@{BACKEND}"
+                if POOLING != "first":
+                    name = f"{name}+{POOLING}"
+                _stores[key] = EmbeddingStore(name, model.config.hidden_size, cache_dir)
+    return _stores[key]
+
+
+def embed_texts_cached(texts, cache_dir, batch_size=BATCH_SIZE):
+    """Like embed_texts, but reuses vectors from the on-disk store and only embeds misses."""
+    store = get_store(cache_dir)
+    keys = [text_key(t) for t in texts]
+    vectors, missing = store.get_many(keys)
+    if missing:
+        fresh = embed_texts([texts[i] for i in missing], batch_size=batch_size).numpy()
+        vectors[missing] = fresh
+        store.put_many([keys[i] for i in missing], fresh)
+    return vectors
+
+
+def normalize_rows(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+def top_k_indices(scores, k):
+    """Indices of the k best scores, best first, without sorting the whole array."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < len(scores):
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+def embed_sections(sections, batch_size=BATCH_SIZE, cache_dir=None):
+    """Unit-normalized (len(sections), dim) matrix of section embeddings."""
+    texts = [s["text"] for s in sections]
+    if cache_dir:
+        vectors = embed_texts_cached(texts, cache_dir, batch_size=batch_size)
+    else:
+        vectors = embed_texts(texts, batch_size=batch_size).numpy()
+    return normalize_rows(vectors)
+
+
+def _ranks(scores):
+    """0-based rank of every score, best first."""
+    ranks = np.empty(len(scores), dtype=np.int64)
+    ranks[np.argsort(-scores, kind="stable")] = np.arange(len(scores))
+    return ranks
+
+
+def prefilter_applies(n_sections, candidates=CANDIDATES, prefilter_min=PREFILTER_MIN_SECTIONS):
+    """Whether rank_sections_many narrows ``n_sections`` sections with BM25 first."""
+    return bool(candidates) and n_sections > max(candidates, prefilter_min)
+
+
+def rank_sections_many(sections, queries, top_k=5, batch_size=BATCH_SIZE, cache_dir=None, section_matrix=None,
+                       candidates=CANDIDATES, prefilter_min=PREFILTER_MIN_SECTIONS):
+    """Rank sections for many (persona, job_to_be_done) pairs with one matrix product.
+
+    Returns one list per query of section copies carrying a "score" key, best
+    first. Pass ``section_matrix`` (from embed_sections) to skip re-embedding.
+
+    With more than ``prefilter_min`` (and ``candidates``) sections, BM25 over
+    titles and bodies first keeps the ``candidates`` best per query; only
+    those are embedded, and their order is the reciprocal rank fusion of the
+    BM25 and embedding ranks. Smaller collections are ranked exhaustively.
+    """
+    if not queries:
+        return []
+    if not sections:
+        return [[] for _ in queries]
+    query_texts = [f"{persona}. {job}" for persona, job in queries]
+    if not prefilter_applies(len(sections), candidates, prefilter_min):
+        if section_matrix is None:
+            section_matrix = embed_sections(sections, batch_size=batch_size, cache_dir=cache_dir)
+        query_matrix = normalize_rows(embed_texts(query_texts, batch_size=batch_size).numpy())
+        scores = query_matrix @ section_matrix.T
+        results = []
+        for row in scores:
+            results.append([dict(sections[i], score=float(row[i])) for i in top_k_indices(row, top_k)])
+        return results
+
+    lexical = BM25Index(sections)
+    pools = []
+    for text in query_texts:
+        bm25 = lexical.scores(text)
+        pool = top_k_indices(bm25, candidates)
+        # Sections that share no term with the query tie for last place.
+        lexical_rank = np.where(bm25[pool] > 0, np.arange(len(pool)), len(pool))
+        pools.append((pool, lexical_rank))
+    if section_matrix is None:
+        rows = np.unique(np.concatenate([pool for pool, _ in pools]))
+        matrix = embed_sections([sections[i] for i in rows], batch_size=batch_size, cache_dir=cache_dir)
+    else:
+        rows, matrix = np.arange(len(sections)), section_matrix
+    query_matrix = normalize_rows(embed_texts(query_texts, batch_size=batch_size).numpy())
+
+    results = []
+    for q, (pool, lexical_rank) in zip(query_matrix, pools):
+        dense_rank = _ranks(matrix[np.searchsorted(rows, pool)] @ q)
+        fused = 1.0 / (RRF_K + 1 + lexical_rank) + 1.0 / (RRF_K + 1 + dense_rank)
+        results.append([dict(sections[pool[i]], score=float(fused[i])) for i in top_k_indices(fused, top_k)])
+    return results
+
+
+def rank_sections(sections, persona, job_to_be_done, top_k=5, batch_size=BATCH_SIZE, cache_dir=None,
+                  candidates=CANDIDATES, prefilter_min=PREFILTER_MIN_SECTIONS):
+    return rank_sections_many(
+        sections, [(persona, job_to_be_done)], top_k=top_k, batch_size=batch_size, cache_dir=cache_dir,
+        candidates=candidates, prefilter_min=prefilter_min,
+    )[0]
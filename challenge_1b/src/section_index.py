@@ -0,0 +1,337 @@
+"""Persistent approximate nearest-neighbour index over section embeddings.
+
+IVF-Flat: once the index holds MIN_TRAIN_ROWS sections, their vectors are
+clustered around ``nlist`` spherical k-means centroids and a query scans only
+the rows of its ``nprobe`` closest clusters. Smaller indexes are searched
+exactly.
+
+Everything lives in one directory:
+
+    log.jsonl            append-only operations; the source of truth
+    vectors-<g>.f32      unit-normalized float32 rows, appended per document
+    centroids-<t>.npy    k-means centroids from training run <t>
+    lists-<t>.i32        cluster id of every row under those centroids
+
+A document is added as one "add" line carrying its sections' metadata, after
+its rows are written; rows past the last logged one (an interrupted add) are
+dropped on load. Deleting a document only logs a tombstone; ``compact()``
+rewrites the files without dead rows. Training writes new centroid/list files
+and switches to them with a single "train" line.
+"""
+import json
+import os
+import threading
+
+import numpy as np
+
+INDEX_DIR = os.path.join(os.getcwd(), "index")
+# Below this many live rows k-means is not worth it and search is exact.
+MIN_TRAIN_ROWS = 20000
+# Retrain once the index has grown this much since the last training.
+RETRAIN_GROWTH = 4.0
+DEFAULT_NPROBE = 8
+# Rows scored per matrix product in exact search and list assignment.
+CHUNK_ROWS = 65536
+
+
+def _normalize(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix[None, :]
+    return matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+
+def _top_k(scores, k):
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    idx = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+    return idx[np.argsort(-scores[idx], kind="stable")]
+
+
+def default_nlist(n_rows):
+    return int(min(65536, max(1, np.sqrt(n_rows))))
+
+
+def spherical_kmeans(vectors, k, iters=15, seed=0):
+    """Centroids (k, dim) of unit vectors under cosine similarity."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), size=k, replace=False)].copy()
+    for _ in range(iters):
+        assign = assign_lists(vectors, centroids)
+        order = np.argsort(assign, kind="stable")
+        counts = np.bincount(assign, minlength=k)
+        sums = vectors[rng.choice(len(vectors), size=k, replace=False)]  # reseeds empty clusters
+        used = counts > 0
+        sums[used] = np.add.reduceat(vectors[order], np.concatenate(([0], np.cumsum(counts)[:-1]))[used])
+        centroids = _normalize(sums)
+    return centroids
+
+
+def assign_lists(vectors, centroids):
+    out = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), CHUNK_ROWS):
+        out[start:start + CHUNK_ROWS] = np.argmax(vectors[start:start + CHUNK_ROWS] @ centroids.T, axis=1)
+    return out
+
+
+class SectionIndex:
+    """Sections of many documents, searchable by embedding.
+
+    ``add_document`` replaces any earlier version of the same document, so
+    re-indexing a changed PDF is an insert plus a delete. Search results are
+    dicts with document, page, title, heading_level and score.
+    """
+
+    def __init__(self, path=INDEX_DIR, dim=384, nlist=None):
+        self.path = path
+        self.dim = dim
+        self.nlist = nlist
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        if not os.path.exists(self._file("log.jsonl")):
+            self._log({"op": "header", "dim": dim, "vectors": 0})
+        self._load()
+
+    # -- persistence -----------------------------------------------------
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _load(self):
+        self.vectors_gen = 0
+        self.train_gen = None
+        self.trained_rows = 0
+        self.n_rows = 0
+        self.documents = {}  # name -> {"version", "start", "count"}
+        self._meta = []  # (start, name, sections) per add, in row order
+        self._dead = []  # (start, count) of deleted documents
+        self.alive = None
+        self._lists = None  # inverted lists, built on first search
+        log_path = self._file("log.jsonl")
+        if os.path.exists(log_path):
+            with open(log_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        self._apply(json.loads(line))
+                    except ValueError:
+                        break  # torn last line
+        self._truncate(self._file(f"vectors-{self.vectors_gen}.f32"), self.n_rows * self.dim * 4)
+        if self.train_gen is not None:
+            self._truncate(self._file(f"lists-{self.train_gen}.i32"), self.n_rows * 4)
+            self.centroids = np.load(self._file(f"centroids-{self.train_gen}.npy"))
+        else:
+            self.centroids = None
+        self.alive = np.ones(self.n_rows, dtype=bool)
+        for start, count in self._dead:
+            self.alive[start:start + count] = False
+        self._remap()
+
+    def _apply(self, op):
+        kind = op["op"]
+        if kind == "header":
+            self.dim = op["dim"]
+            self.vectors_gen = op["vectors"]
+        elif kind == "add":
+            self._delete(op["document"])
+            self.documents[op["document"]] = {"version": op.get("version"), "start": op["start"], "count": op["count"]}
+            self._meta.append((op["start"], op["document"], op["sections"]))
+            self.n_rows = op["start"] + op["count"]
+        elif kind == "delete":
+            self._delete(op["document"])
+        elif kind == "train":
+            self.train_gen = op["gen"]
+            self.trained_rows = op["rows"]
+
+    def _delete(self, name):
+        doc = self.documents.pop(name, None)
+        if doc is not None:
+            self._dead.append((doc["start"], doc["count"]))
+            if self.alive is not None:
+                self.alive[doc["start"]:doc["start"] + doc["count"]] = False
+
+    @staticmethod
+    def _truncate(path, size):
+        if os.path.exists(path) and os.path.getsize(path) > size:
+            with open(path, "r+b") as f:
+                f.truncate(size)
+
+    def _log(self, op):
+        with open(self._file("log.jsonl"), "a", encoding="utf-8") as f:
+            f.write(json.dumps(op, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _remap(self):
+        path = self._file(f"vectors-{self.vectors_gen}.f32")
+        if self.n_rows and os.path.exists(path):
+            self.vectors = np.memmap(path, dtype=np.float32, mode="r", shape=(self.n_rows, self.dim))
+        else:
+            self.vectors = np.empty((0, self.dim), dtype=np.float32)
+        self._starts = np.array([start for start, _, _ in self._meta], dtype=np.int64)
+
+    def _inverted_lists(self):
+        if self._lists is None:
+            assign = np.fromfile(self._file(f"lists-{self.train_gen}.i32"), dtype=np.int32, count=self.n_rows)
+            rows = np.flatnonzero(self.alive)
+            order = rows[np.argsort(assign[rows], kind="stable")]
+            bounds = np.searchsorted(assign[order], np.arange(len(self.centroids) + 1))
+            self._lists = [order[bounds[i]:bounds[i + 1]] for i in range(len(self.centroids))]
+        return self._lists
+
+    # -- updates ---------------------------------------------------------
+
+    def __len__(self):
+        return int(self.alive.sum())
+
+    def has_document(self, name, version=None):
+        doc = self.documents.get(name)
+        return doc is not None and (version is None or doc["version"] == version)
+
+    def add_document(self, name, sections, vectors, version=None):
+        """Insert (or replace) one document's sections with their embeddings."""
+        vectors = _normalize(vectors).reshape(-1, self.dim)
+        if len(vectors) != len(sections):
+            raise ValueError(f"{len(sections)} sections but {len(vectors)} vectors")
+        meta = [[s.get("page"), s.get("title"), s.get("heading_level")] for s in sections]
+        with self._lock:
+            start = self.n_rows
+            with open(self._file(f"vectors-{self.vectors_gen}.f32"), "ab") as f:
+                f.write(vectors.tobytes())
+            assign = None
+            if self.train_gen is not None:
+                assign = assign_lists(vectors, self.centroids)
+                with open(self._file(f"lists-{self.train_gen}.i32"), "ab") as f:
+                    f.write(assign.tobytes())
+            op = {"op": "add", "document": name, "version": version, "start": start,
+                  "count": len(vectors), "sections": meta}
+            self._log(op)
+            self.alive = np.concatenate([self.alive, np.ones(len(vectors), dtype=bool)])
+            self._apply(op)
+            self._remap()
+            if assign is not None and self._lists is not None:
+                rows = np.arange(start, start + len(vectors))
+                for c in np.unique(assign).tolist():
+                    self._lists[c] = np.concatenate([self._lists[c], rows[assign == c]])
+            self._maybe_train()
+
+    def remove_document(self, name):
+        with self._lock:
+            if name not in self.documents:
+                return False
+            self._log({"op": "delete", "document": name})
+            self._delete(name)  # rows stay in the inverted lists; search skips them
+            return True
+
+    def _maybe_train(self):
+        live = len(self)
+        if live < MIN_TRAIN_ROWS:
+            return
+        if self.train_gen is None or live >= RETRAIN_GROWTH * self.trained_rows:
+            self._train()
+
+    def train(self):
+        """(Re)cluster the live rows now instead of waiting for the growth trigger."""
+        with self._lock:
+            if len(self):
+                self._train()
+
+    def _train(self):
+        rows = np.flatnonzero(self.alive)
+        nlist = min(self.nlist or default_nlist(len(rows)), len(rows))
+        rng = np.random.default_rng(0)
+        sample = np.sort(rng.choice(rows, size=min(len(rows), 32 * nlist), replace=False))
+        centroids = spherical_kmeans(np.asarray(self.vectors[sample]), nlist)
+        gen = 0 if self.train_gen is None else self.train_gen + 1
+        np.save(self._file(f"centroids-{gen}.npy"), centroids)
+        with open(self._file(f"lists-{gen}.i32"), "wb") as f:
+            for start in range(0, self.n_rows, CHUNK_ROWS):
+                f.write(assign_lists(np.asarray(self.vectors[start:start + CHUNK_ROWS]), centroids).tobytes())
+        old = self.train_gen
+        self._log({"op": "train", "gen": gen, "rows": len(rows), "nlist": nlist})
+        self.train_gen, self.trained_rows, self.centroids = gen, len(rows), centroids
+        self._lists = None
+        if old is not None:
+            for name in (f"centroids-{old}.npy", f"lists-{old}.i32"):
+                os.remove(self._file(name))
+
+    def compact(self):
+        """Rewrite the index without deleted rows."""
+        with self._lock:
+            gen = self.vectors_gen + 1
+            ops = [{"op": "header", "dim": self.dim, "vectors": gen}]
+            rows_out = 0
+            with open(self._file(f"vectors-{gen}.f32"), "wb") as f:
+                for start, name, sections in self._meta:
+                    doc = self.documents.get(name)
+                    if doc is None or doc["start"] != start:
+                        continue
+                    f.write(np.asarray(self.vectors[start:start + doc["count"]]).tobytes())
+                    ops.append({"op": "add", "document": name, "version": doc["version"], "start": rows_out,
+                                "count": doc["count"], "sections": sections})
+                    rows_out += doc["count"]
+            tmp = self._file("log.jsonl.tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.writelines(json.dumps(op, ensure_ascii=False) + "\n" for op in ops)
+            os.replace(tmp, self._file("log.jsonl"))
+            old_vectors, old_train = self.vectors_gen, self.train_gen
+            self.vectors = None
+            self._load()
+            os.remove(self._file(f"vectors-{old_vectors}.f32"))
+            if old_train is not None:
+                os.remove(self._file(f"centroids-{old_train}.npy"))
+                os.remove(self._file(f"lists-{old_train}.i32"))
+            if len(self) >= MIN_TRAIN_ROWS:
+                self._train()
+
+    # -- queries ---------------------------------------------------------
+
+    def _row_meta(self, row):
+        i = int(np.searchsorted(self._starts, row, side="right")) - 1
+        start, name, sections = self._meta[i]
+        page, title, level = sections[row - start]
+        return {"document": name, "page": page, "title": title, "heading_level": level}
+
+    def _results(self, rows, scores):
+        return [dict(self._row_meta(int(r)), score=float(s)) for r, s in zip(rows, scores)]
+
+    def search(self, queries, k=5, nprobe=DEFAULT_NPROBE):
+        """Top-k sections for each query vector; one result list per query."""
+        queries = _normalize(queries)
+        if self.centroids is None:
+            return self.search_exact(queries, k)
+        lists = self._inverted_lists()
+        probe = min(nprobe, len(lists))
+        results = []
+        for q, cscores in zip(queries, queries @ self.centroids.T):
+            rows = np.concatenate([lists[c] for c in _top_k(cscores, probe)])
+            rows = rows[self.alive[rows]]
+            if not len(rows):
+                results.append([])
+                continue
+            rows.sort()  # sequential reads from the memory map
+            scores = np.asarray(self.vectors[rows]) @ q
+            best = _top_k(scores, k)
+            results.append(self._results(rows[best], scores[best]))
+        return results
+
+    def search_exact(self, queries, k=5):
+        """Brute-force top-k over every live row (the recall baseline)."""
+        queries = _normalize(queries)
+        if not len(queries):
+            return []
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        for start in range(0, self.n_rows, CHUNK_ROWS):
+            scores = queries @ np.asarray(self.vectors[start:start + CHUNK_ROWS]).T
+            scores[:, ~self.alive[start:start + CHUNK_ROWS]] = -np.inf
+            rows = np.broadcast_to(np.arange(start, start + scores.shape[1]), scores.shape)
+            best_rows = np.concatenate([best_rows, rows], axis=1)
+            best_scores = np.concatenate([best_scores, scores], axis=1)
+            keep = np.stack([_top_k(row, k) for row in best_scores])
+            best_rows = np.take_along_axis(best_rows, keep, axis=1)
+            best_scores = np.take_along_axis(best_scores, keep, axis=1)
+        return [
+            self._results(r[np.isfinite(s)], s[np.isfinite(s)])
+            for r, s in zip(best_rows, best_scores)
+        ]
@@ -1,17 +1,81 @@
-from transformers import pipeline
+import threading
+import time
 
 # Use a small model for offline summarization
-summarizer = pipeline("summarization", model="sshleifer/distilbart-cnn-12-6")
+MODEL_NAME = "sshleifer/distilbart-cnn-12-6"
+
+# Built on first use, once per process
+_summarizer = None
+_summarizer_lock = threading.Lock()
+load_times = {}
+
+def get_summarizer():
+    global _summarizer
+    if _summarizer is None:
+        with _summarizer_lock:
+            if _summarizer is None:
+                start = time.perf_counter()
+                from transformers import pipeline
+                load_times["summarizer_import"] = time.perf_counter() - start
+
+                start = time.perf_counter()
+                _summarizer = pipeline("summarization", model=MODEL_NAME)
+                load_times["summarizer_model"] = time.perf_counter() - start
+    return _summarizer
+
+def warm_up():
+    get_summarizer()
+
+def _truncate(text, max_input_len=1024):
+    # Cheap cut before tokenizing; words are often several tokens each, so
+    # the pipeline still truncates to the model's limit (truncation=True)
+    words = text.split()
+    return text if len(words) < max_input_len else " ".join(words[:max_input_len])
+
+def summarize_many(texts, max_tokens=100, batch_size=8, num_threads=None, stats=None):
+    """Summarize many texts in batches; results come back in input order.
+
+    Inputs are grouped by length so each batch pads to similar sizes. If
+    ``stats`` is a list, one dict per batch (size, longest input in words,
+    seconds) is appended to it.
+    """
+    results = [{"refined_text": ""} for _ in texts]
+    pending = sorted(
+        ((i, _truncate(t)) for i, t in enumerate(texts) if t.strip()),
+        key=lambda item: len(item[1].split()),
+    )
+    if not pending:
+        return results
+
+    summarizer = get_summarizer()
+    import torch
+
+    previous_threads = torch.get_num_threads()
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    try:
+        for start in range(0, len(pending), batch_size):
+            batch = pending[start:start + batch_size]
+            began = time.perf_counter()
+            summaries = summarizer(
+                [text for _, text in batch],
+                max_length=max_tokens,
+                min_length=20,
+                do_sample=False,
+                truncation=True,
+                batch_size=len(batch),
+            )
+            if stats is not None:
+                stats.append({
+                    "size": len(batch),
+                    "max_words": len(batch[-1][1].split()),
+                    "seconds": time.perf_counter() - began,
+                })
+            for (i, _), summary in zip(batch, summaries):
+                results[i] = {"refined_text": summary["summary_text"]}
+    finally:
+        torch.set_num_threads(previous_threads)
+    return results
 
 def summarize(text, max_tokens=100):
-    if not text.strip():
-        return {"refined_text": ""}
-    
-    # Limit to max tokens allowed by the model
-    max_input_len = 1024
-    input_text = text if len(text.split()) < max_input_len else " ".join(text.split()[:max_input_len])
-
-    summary = summarizer(input_text, max_length=max_tokens, min_length=20, do_sample=False)
-    return {
-        "refined_text": summary[0]["summary_text"]
-    }
+    return summarize_many([text], max_tokens=max_tokens)[0]
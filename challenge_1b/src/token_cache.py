@@ -0,0 +1,143 @@
+"""In-memory LRU cache of tokenized texts.
+
+Guide collections repeat the same boilerplate sections, and the service sees
+the same persona/job queries again and again, so token ids are kept per text
+(keyed on a hash of the text) and only texts not seen before go through the
+tokenizer, in one batched call.
+
+Texts tokenized ahead of time (``background=True``, see ranker.Pretokenizer)
+are counted apart: a later hit on one of them did not avoid tokenizer work,
+it only moved it off the caller's thread.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+# Token ids held before the least recently used texts are evicted (4 bytes each).
+MAX_TOKENS = 4_000_000
+COUNTERS = (
+    "hits", "misses", "seconds", "chars_hit", "chars_missed",
+    "pretokenized", "pretokenize_seconds", "chars_pretokenized", "chars_moved",
+)
+
+
+def _key(text):
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
+class TokenCache:
+    def __init__(self, max_tokens=MAX_TOKENS):
+        self.max_tokens = max_tokens
+        self._entries = OrderedDict()
+        self._tokens = 0
+        self._ahead = set()  # keys tokenized in the background and not looked up since
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.seconds = 0.0  # spent in the tokenizer on misses
+        self.chars_hit = 0
+        self.chars_missed = 0
+        self.pretokenized = 0
+        self.pretokenize_seconds = 0.0
+        self.chars_pretokenized = 0
+        self.chars_moved = 0  # hits on texts tokenized in the background
+
+    def __len__(self):
+        return len(self._entries)
+
+    def encode_many(self, tokenizer, texts, background=False):
+        """Token ids (int32 arrays, no special tokens) for ``texts``, in order.
+
+        ``background`` marks tokenizing ahead of use: it is kept out of the
+        hit/miss counts, and texts it adds are reported as moved, not saved,
+        when they are looked up.
+        """
+        keys = [_key(t) for t in texts]
+        out = [None] * len(texts)
+        missing = {}  # key -> positions, so repeats within one call tokenize once
+        with self._lock:
+            for i, key in enumerate(keys):
+                ids = self._entries.get(key)
+                if ids is None:
+                    missing.setdefault(key, []).append(i)
+                    continue
+                self._entries.move_to_end(key)
+                out[i] = ids
+                if not background:
+                    self._count_hit(key, texts[i])
+        if not missing:
+            return out
+
+        todo = [texts[positions[0]] for positions in missing.values()]
+        start = time.perf_counter()
+        encoded = tokenizer(todo, add_special_tokens=False, verbose=False)["input_ids"]
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            if background:
+                self.pretokenized += len(todo)
+                self.pretokenize_seconds += elapsed
+                self.chars_pretokenized += sum(len(t) for t in todo)
+            else:
+                self.seconds += elapsed
+                self.misses += len(todo)
+                self.chars_missed += sum(len(t) for t in todo)
+            for (key, positions), ids in zip(missing.items(), encoded):
+                ids = np.asarray(ids, dtype=np.int32)
+                for i in positions:
+                    out[i] = ids
+                if not background:
+                    for i in positions[1:]:
+                        self.hits += 1
+                        self.chars_hit += len(texts[i])
+                if self._put(key, ids) and background:
+                    self._ahead.add(key)
+        return out
+
+    def _count_hit(self, key, text):
+        self.hits += 1
+        if key in self._ahead:
+            self._ahead.discard(key)
+            self.chars_moved += len(text)
+        else:
+            self.chars_hit += len(text)
+
+    def _put(self, key, ids):
+        """Store ``ids``; False if ``key`` was already cached."""
+        if key in self._entries:
+            return False
+        self._entries[key] = ids
+        self._tokens += len(ids)
+        while self._tokens > self.max_tokens and len(self._entries) > 1:
+            evicted_key, evicted = self._entries.popitem(last=False)
+            self._tokens -= len(evicted)
+            self._ahead.discard(evicted_key)
+        return True
+
+    def snapshot(self):
+        with self._lock:
+            return {name: getattr(self, name) for name in COUNTERS}
+
+    def report(self, since=None):
+        """Hit rate and tokenizer time since ``since`` (a snapshot).
+
+        ``seconds_saved`` estimates the work hits avoided; ``seconds_moved``
+        the part of it that was really done on the background thread.
+        """
+        now = self.snapshot()
+        delta = {name: now[name] - (since or {}).get(name, 0) for name in COUNTERS}
+        lookups = delta["hits"] + delta["misses"]
+        chars = now["chars_missed"] + now["chars_pretokenized"]
+        per_char = (now["seconds"] + now["pretokenize_seconds"]) / chars if chars else 0.0
+        return {
+            "hits": delta["hits"],
+            "misses": delta["misses"],
+            "hit_rate": round(delta["hits"] / lookups, 4) if lookups else 0.0,
+            "tokenize_seconds": round(delta["seconds"], 4),
+            "pretokenized": delta["pretokenized"],
+            "pretokenize_seconds": round(delta["pretokenize_seconds"], 4),
+            "seconds_moved": round(delta["chars_moved"] * per_char, 4),
+            "seconds_saved": round(delta["chars_hit"] * per_char, 4),
+        }